@@ -0,0 +1,722 @@
+#=============================================================================
+# asyncio client for the Refinitiv Data Platform news and research messages
+# This module uses aiohttp for the RDP REST calls and aiobotocore for the AWS SQS queue,
+# so one event loop can drive many long-polls and report downloads without a thread each
+#	python3 -m pip install aiohttp aiobotocore
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import asyncio
+import concurrent.futures
+import json
+import functools
+import os
+import time
+import traceback
+import aiohttp
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+import rdpToken
+import rdpClient
+import sqsQueue
+import credentialManager
+import dedupeCache
+import backpressure
+import pipelineMetrics
+import visibilityHeartbeat
+import newsMessages
+import researchMessages
+
+# Application Constants
+base_URL = "https://api.refinitiv.com"
+RDP_version = "/v1"
+# maximum number of open connections of a HTTP session
+HTTP_CONNECTION_LIMIT = 1000
+# maximum number of messages processed at the same time per queue
+DEFAULT_CONCURRENCY = 10
+
+
+#==============================================
+def createHttpSession(limit=HTTP_CONNECTION_LIMIT):
+#==============================================
+	# must be called from a coroutine, the session is bound to the running loop
+	return aiohttp.ClientSession(connector = aiohttp.TCPConnector(limit = limit))
+
+
+#==============================================
+async def getToken():
+#==============================================
+	# the token is read from a file and refreshed rarely, keep it off the event loop anyway
+	return await asyncio.get_event_loop().run_in_executor(None, rdpToken.getToken)
+
+
+#==============================================
+async def _request(http, method, url, stream=False, **kwargs):
+#==============================================
+	# asyncio counterpart of rdpClient.request, with the same pacing, 429 and 401 handling.
+	# With stream the response is returned unread, the caller reads it in chunks and releases it
+	bucket = rdpClient.bucketFor(url)
+	attempt = 0
+	renewed = False
+	while 1:
+		if bucket is not None:
+			wait = bucket.reserve()
+			if wait > 0:
+				await asyncio.sleep(wait)
+		dResp = await http.request(method, url, **kwargs)
+		status = dResp.status
+		respHeaders = dResp.headers
+		if stream and not (status == 429 and attempt < rdpClient.MAX_RETRIES) and not (status == 401 and not renewed):
+			return dResp
+		async with dResp:
+			content = await dResp.read()
+
+		if status == 429 and attempt < rdpClient.MAX_RETRIES:
+			delay = rdpClient.retryDelay(respHeaders, attempt)
+			attempt += 1
+			print("Request to %s throttled, retrying in %.1f seconds" % (url, delay))
+			if bucket is not None:
+				bucket.pause(delay)
+			else:
+				await asyncio.sleep(delay)
+			continue
+
+		if status == 401 and not renewed:
+			renewed = True
+			headers = await asyncio.get_event_loop().run_in_executor(None, rdpClient.renewAuthorization, kwargs.get("headers"))
+			if headers is not None:
+				print("Access token rejected, retrying with a new token")
+				kwargs["headers"] = headers
+				continue
+		if stream:
+			# the body was read already, read() returns it again
+			return dResp
+		return status, content
+
+
+#==============================================
+async def _download(http, url, fileName, expectedSize=None, partFile=None, **kwargs):
+#==============================================
+	# asyncio counterpart of rdpClient.download: streamed to partFile, resumed with a Range request and
+	# renamed once complete. Returns whether fileName was saved, the status and the error message
+	loop = asyncio.get_event_loop()
+	partFile = partFile or fileName + rdpClient.PART_SUFFIX
+	headers = dict(kwargs.pop("headers", None) or {})
+	headers["Accept-Encoding"] = "identity"
+	attempt = 0
+	while 1:
+		offset = os.path.getsize(partFile) if os.path.exists(partFile) else 0
+		if offset:
+			headers["Range"] = "bytes=%d-" % offset
+		else:
+			headers.pop("Range", None)
+		dResp = await _request(http, "GET", url, stream = True, headers = headers, **kwargs)
+		async with dResp:
+			status = dResp.status
+			if status == 416 and offset:
+				# the part file reaches the end of the document, Content-Range is bytes */<size>
+				total = dResp.headers.get("Content-Range", "").rpartition("/")[2]
+				size = int(total) if total.isdigit() else expectedSize
+				if size is None or offset != size or (expectedSize is not None and size != expectedSize):
+					# larger than the document, or left by another one, start over
+					os.remove(partFile)
+					continue
+				# complete already, only the rename was missing
+				expectedSize = size
+			elif status == 206 and dResp.headers.get("Content-Range", "").startswith("bytes %d-" % offset):
+				size = rdpClient.contentLength(status, dResp.headers)
+				mode = "ab"
+			elif status == 200:
+				# the server sent the whole document again
+				size = rdpClient.contentLength(status, dResp.headers)
+				mode = "wb"
+			elif status == 206:
+				# not the range asked for, start over
+				os.remove(partFile)
+				continue
+			else:
+				return False, status, (await dResp.read()).decode(errors = 'replace')
+
+			if status != 416:
+				expectedSize = expectedSize or size
+				try:
+					with open(partFile, mode) as f:
+						async for chunk in dResp.content.iter_chunked(rdpClient.CHUNK_SIZE):
+							# the disk does not hold up the other downloads and polls of the loop
+							await loop.run_in_executor(None, f.write, chunk)
+				except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+					attempt += 1
+					if attempt > rdpClient.DOWNLOAD_RETRIES:
+						raise
+					print("Download of %s interrupted, resuming: %s" % (fileName, err))
+					continue
+
+		received = os.path.getsize(partFile)
+		if expectedSize is not None and received < expectedSize:
+			attempt += 1
+			if attempt > rdpClient.DOWNLOAD_RETRIES:
+				raise Exception("Download of %s incomplete, %d of %d bytes" % (fileName, received, expectedSize))
+			print("Download of %s incomplete, resuming at %d of %d bytes" % (fileName, received, expectedSize))
+			continue
+		if expectedSize is not None and received > expectedSize:
+			os.remove(partFile)
+			raise Exception("Download of %s is %d bytes, expected %d" % (fileName, received, expectedSize))
+		os.replace(partFile, fileName)
+		return True, status, None
+
+
+#==============================================
+async def _requestJson(http, method, RESOURCE_ENDPOINT, errorText, **kwargs):
+#==============================================
+	accessToken = await getToken()
+	hdrs = {
+		"Authorization": "Bearer " + accessToken,
+		"Content-Type": "application/json"
+	}
+	status, content = await _request(http, method, RESOURCE_ENDPOINT, headers = hdrs, **kwargs)
+	text = content.decode(errors = 'replace')
+	if status != 200:
+		raise ValueError("%s. Code %s, Message: %s" % (errorText, status, text))
+	return json.loads(text)
+
+
+#==============================================
+async def subscribeToResearch(http):
+#==============================================
+	# make sure the UUID is loaded from the credentials file
+	await getToken()
+	RESOURCE_ENDPOINT = base_URL + "/message-services" + RDP_version + "/research/subscriptions"
+	requestData = {
+		"transport": {
+			"transportType": "AWS-SQS"
+		},
+		"userID": rdpToken.UUID
+	}
+
+	jResp = await _requestJson(http, "POST", RESOURCE_ENDPOINT, "Unable to subscribe", data = json.dumps(requestData))
+	return jResp["transportInfo"]["endpoint"], jResp["transportInfo"]["cryptographyKey"], jResp["subscriptionID"]
+
+
+#==============================================
+async def getResearchSubscription(http, subscriptionId):
+#==============================================
+	await getToken()
+	RESOURCE_ENDPOINT = base_URL + "/message-services" + RDP_version + "/research/subscriptions"
+	jResp = await _requestJson(http, "GET", RESOURCE_ENDPOINT, "Unable to get subscriptions",
+		params = {"subscriptionID": subscriptionId, "userID": rdpToken.UUID})
+
+	for subscription in jResp.get('subscriptions', []):
+		return subscription['transportInfo']['endpoint'], subscription['transportInfo']['cryptographyKey'], subscription['subscriptionID']
+	return None, None, None
+
+
+#==============================================
+async def subscribeToNews(http, headlines=True):
+#==============================================
+	if headlines:
+		RESOURCE_ENDPOINT = base_URL + newsMessages.category_URL + RDP_version + newsMessages.endpoint_URL_headlines
+	else:
+		RESOURCE_ENDPOINT = base_URL + newsMessages.category_URL + RDP_version + newsMessages.endpoint_URL_stories
+
+	requestData = {
+		"transport": {
+			"transportType": "AWS-SQS"
+		},
+		"payloadVersion": "2.0"
+	}
+
+	jResp = await _requestJson(http, "POST", RESOURCE_ENDPOINT, "Unable to subscribe", data = json.dumps(requestData))
+	return jResp["transportInfo"]["endpoint"], jResp["transportInfo"]["cryptographyKey"], jResp["subscriptionID"]
+
+
+#==============================================
+async def removeNewsSubscription(http, subscriptionId, headlines=True):
+#==============================================
+	if headlines:
+		RESOURCE_ENDPOINT = base_URL + newsMessages.category_URL + RDP_version + newsMessages.endpoint_URL_headlines
+	else:
+		RESOURCE_ENDPOINT = base_URL + newsMessages.category_URL + RDP_version + newsMessages.endpoint_URL_stories
+
+	accessToken = await getToken()
+	status, content = await _request(http, "DELETE", RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken},
+		params = {"subscriptionID": subscriptionId})
+	if status > 299:
+		print("Warning: unable to remove subscription. Code %s, Message: %s" % (status, content.decode(errors = 'replace')))
+	else:
+		print("News messages unsubscribed!")
+
+
+#==============================================
+async def requestCloudCredentials(http, endpoint):
+#==============================================
+	RESOURCE_ENDPOINT = base_URL + "/auth/cloud-credentials" + RDP_version + "/"
+	jResp = await _requestJson(http, "GET", RESOURCE_ENDPOINT, "Unable to get credentials", params = {"endpoint": endpoint})
+	# accessKeyId, secretKey, sessionToken and expiration
+	return jResp["credentials"]
+
+
+#==============================================
+async def getCloudCredentials(http, endpoint):
+#==============================================
+	jCredentials = await requestCloudCredentials(http, endpoint)
+	return jCredentials["accessKeyId"], jCredentials["secretKey"], jCredentials["sessionToken"]
+
+
+#==============================================
+async def _credentialWorker(http, endpoint, credentials):
+#==============================================
+	# renews the credentials ahead of the expiry, the clients rotate through the manager listeners
+	while 1:
+		await asyncio.sleep(credentials.secondsUntilRefresh())
+		try:
+			credentials.update(await requestCloudCredentials(http, endpoint))
+		except Exception as err:
+			traceback.print_exc()
+			print("Unable to refresh cloud credentials: %s" % err)
+			await asyncio.sleep(credentialManager.RETRY_SECONDS)
+
+
+#==============================================
+def _createSqsClient(session, accessID, secretKey, sessionToken):
+#==============================================
+	return session.create_client('sqs',
+		region_name = sqsQueue.REGION,
+		aws_access_key_id = accessID,
+		aws_secret_access_key = secretKey,
+		aws_session_token = sessionToken)
+
+
+#==============================================
+class RotatingClient:
+#==============================================
+	# asyncio counterpart of credentialManager.RotatingClient for aiobotocore clients
+	def __init__(self, session, credentials):
+		self.session = session
+		self.credentials = credentials
+		self.context = None
+		self.client = None
+		self.swaps = set()
+
+	async def __aenter__(self):
+		self.context = _createSqsClient(self.session, *self.credentials.current())
+		self.client = await self.context.__aenter__()
+		self.credentials.subscribe(self._rotate)
+		return self
+
+	async def __aexit__(self, *exc):
+		self.credentials.unsubscribe(self._rotate)
+		for task in list(self.swaps):
+			task.cancel()
+		if self.swaps:
+			await asyncio.gather(*self.swaps, return_exceptions = True)
+		await self.context.__aexit__(*exc)
+
+	def _rotate(self, accessID, secretKey, sessionToken):
+		# called on the loop by _credentialWorker
+		task = asyncio.ensure_future(self._swap(accessID, secretKey, sessionToken))
+		self.swaps.add(task)
+		task.add_done_callback(self.swaps.discard)
+
+	async def _swap(self, accessID, secretKey, sessionToken):
+		context = _createSqsClient(self.session, accessID, secretKey, sessionToken)
+		client = await context.__aenter__()
+		previous = self.context
+		self.context = context
+		self.client = client
+		try:
+			# calls in flight, e.g. a long poll, finish on the previous client
+			await asyncio.sleep(2 * sqsQueue.WAIT_TIME_SECONDS)
+		finally:
+			await previous.__aexit__(None, None, None)
+
+	def __getattr__(self, name):
+		return getattr(self.client, name)
+
+
+#==============================================
+async def downloadReport(http, rMessage, subscriptionId, fileTypeValue, isRawResponse):
+#==============================================
+	# returns False when the report could not be downloaded, like researchMessages.downloadReport
+	loop = asyncio.get_event_loop()
+	target = researchMessages.reportTarget(rMessage, subscriptionId, fileTypeValue, isRawResponse)
+	if not researchMessages.isDownloadable(target):
+		researchMessages.saveReportNotice(rMessage, target)
+		return True
+	# a report downloaded before, on any subscription, is linked instead
+	if await loop.run_in_executor(None, researchMessages.linkStoredReport, target, subscriptionId):
+		return True
+
+	print('Downloading the file: %s' % target["filename"])
+	RESOURCE_ENDPOINT, requestData = researchMessages.reportRequest(target)
+	# aiohttp only accepts strings as query values
+	requestData = {k: str(v) for k, v in requestData.items()}
+
+	accessToken = await getToken()
+	headers = {"Authorization": "Bearer " + accessToken}
+	if target["isRawResponse"] or target["fileTypeInput"] == 'txt':
+		# a small JSON or text response, saved by saveReport
+		status, content = await _request(http, "GET", RESOURCE_ENDPOINT, headers = headers, params = requestData)
+		if status != 200:
+			print("Error - Unable to get the research report. Code %s, Message: %s" % (status, content.decode(errors = 'replace')))
+			return False
+		await loop.run_in_executor(None, researchMessages.saveReport, target, content)
+		await loop.run_in_executor(None, researchMessages.storeReport, target, subscriptionId)
+		return True
+
+	# streamed to disk like researchMessages.downloadReport, memory does not grow with the document size
+	expectedSize = target["size"] if target["fileType"] == 'pdf' else None
+	partFile = "{}/{}_{}{}".format(target["folder"], target["docID"], target["fileTypeInput"], rdpClient.PART_SUFFIX)
+	saved, status, message = await _download(http, RESOURCE_ENDPOINT, target["folder"] + "/" + target["filename"], expectedSize,
+		partFile, headers = headers, params = requestData)
+	if not saved:
+		print("Error - Unable to get the research report. Code %s, Message: %s" % (status, message))
+		return False
+	await loop.run_in_executor(None, researchMessages.storeReport, target, subscriptionId)
+	return True
+
+
+#==============================================
+async def _deleteMessages(sqs, endpoint, messages, stats):
+#==============================================
+	if len(messages) == 1:
+		await sqs.delete_message(QueueUrl = endpoint, ReceiptHandle = messages[0]['ReceiptHandle'])
+		stats['apiCalls'] += 1
+		return
+
+	entries = [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, message in enumerate(messages)]
+	resp = await sqs.delete_message_batch(QueueUrl = endpoint, Entries = entries)
+	stats['apiCalls'] += 1
+
+	# retry the failed entries of a partial batch on their own
+	for failed in resp.get('Failed', []):
+		print("Unable to delete message in batch. Code %s, Message: %s" % (failed.get('Code'), failed.get('Message')))
+		if failed.get('SenderFault'):
+			continue
+		try:
+			await sqs.delete_message(QueueUrl = endpoint, ReceiptHandle = entries[int(failed['Id'])]['ReceiptHandle'])
+		except ClientError as err:
+			print("Unable to delete message: %s" % err)
+		stats['apiCalls'] += 1
+
+
+#==============================================
+async def _changeVisibility(sqs, endpoint, handles, visibilityTimeout):
+#==============================================
+	for entries in visibilityHeartbeat.visibilityEntries(handles, visibilityTimeout):
+		visibilityHeartbeat.printFailed(await sqs.change_message_visibility_batch(QueueUrl = endpoint, Entries = entries))
+
+
+#==============================================
+async def _heartbeatWorker(sqs, endpoint, heartbeat):
+#==============================================
+	while 1:
+		await asyncio.sleep(heartbeat.interval / 2.0)
+		try:
+			handles = heartbeat.dueHandles()
+			if handles:
+				await _changeVisibility(sqs, endpoint, handles, heartbeat.visibilityTimeout)
+		except Exception as err:
+			traceback.print_exc()
+			print(err)
+
+
+#==============================================
+async def _backlogWorker(sqs, endpoint, metrics, interval):
+#==============================================
+	while 1:
+		try:
+			resp = await sqs.get_queue_attributes(QueueUrl = endpoint, AttributeNames = list(pipelineMetrics.BACKLOG_ATTRIBUTES))
+			metrics.setBacklog(resp.get('Attributes', {}))
+		except Exception as err:
+			print("Unable to sample the queue backlog: %s" % err)
+		await asyncio.sleep(interval)
+
+
+#==============================================
+async def _acknowledgeMessages(sqs, endpoint, messages, stats, beforeDelete=None, heartbeat=None):
+#==============================================
+	if beforeDelete is not None:
+		await asyncio.get_event_loop().run_in_executor(None, beforeDelete)
+	# failed messages are not deleted, so they are processed again (up to MAX_RECEIVE_COUNT receives)
+	retry = [m for m in messages if not m.get('_processed', True)
+		and int(m.get('Attributes', {}).get('ApproximateReceiveCount', 1)) < sqsQueue.MAX_RECEIVE_COUNT]
+	done = [m for m in messages if m not in retry]
+	if heartbeat is None:
+		if done:
+			await _deleteMessages(sqs, endpoint, done, stats)
+		if retry:
+			print("Leaving %d failed messages in the queue" % len(retry))
+		return
+
+	# give failed messages back to the queue for a quick retry instead of waiting for the visibility timeout
+	heartbeat.done(done)
+	if done:
+		await _deleteMessages(sqs, endpoint, done, stats)
+	if retry:
+		print("Returning %d failed messages to the queue" % len(retry))
+		heartbeat.done(retry)
+		await _changeVisibility(sqs, endpoint, [m['ReceiptHandle'] for m in retry], 0)
+
+
+#==============================================
+async def _deleteWorker(deleteQueue, acknowledge, batchSize, stats):
+#==============================================
+	done = False
+	while not done:
+		messages = [await deleteQueue.get()]
+		while len(messages) < batchSize:
+			try:
+				messages.append(deleteQueue.get_nowait())
+			except asyncio.QueueEmpty:
+				break
+		if None in messages:
+			done = True
+			messages = [m for m in messages if m is not None]
+		if messages:
+			await acknowledge(messages)
+			sqsQueue.printThroughput(stats)
+
+
+#==============================================
+def _prepareMessage(message, decryptor, subscriptionId, destinationFolder, store, dedupe, stats, metrics):
+#==============================================
+	# the blocking part of _processMessage, run in the executor: dedupe lookups (dbm), decryption and
+	# the metadata write. Returns None for a duplicate, else the message, its DocumentId and stage times
+	messageId = message.get('MessageId')
+	# redelivered messages are acknowledged without processing them again
+	if sqsQueue.isDuplicate(dedupe, stats, messageId = messageId, metrics = metrics):
+		return None
+	start = time.perf_counter()
+	payloadText = decryptor.decrypt(message['Body'])
+	decrypted = time.perf_counter()
+	rMessage = json.loads(payloadText)
+	documentId = dedupeCache.documentIdOf(rMessage)
+	if sqsQueue.isDuplicate(dedupe, stats, documentId = documentId, metrics = metrics):
+		return None
+	parsed = time.perf_counter()
+	sqsQueue.storeMessage(rMessage, subscriptionId, destinationFolder, store, messageId)
+	return rMessage, documentId, (decrypted - start, parsed - decrypted, time.perf_counter() - parsed)
+
+
+#==============================================
+async def _processMessage(message, deleteQueue, slots, decryptor, subscriptionId, fileType, destinationFolder, isRawResponse, callback, store, dedupe, stats, metrics=None):
+#==============================================
+	loop = asyncio.get_event_loop()
+	message['_processed'] = False
+	messageId = message.get('MessageId')
+	try:
+		# the disk and the decryption do not hold up the polls and heartbeats of the loop
+		prepared = await loop.run_in_executor(None, _prepareMessage, message, decryptor, subscriptionId, destinationFolder, store, dedupe, stats, metrics)
+		if prepared is None:
+			message['_processed'] = True
+			return
+		rMessage, documentId, (decryptTime, parseTime, storeTime) = prepared
+		stored = time.perf_counter()
+
+		# handover the decoded message to calling module, which may be a coroutine
+		result = None
+		if callback is not None:
+			result = callback(rMessage, subscriptionId, fileType, isRawResponse)
+			if asyncio.iscoroutine(result):
+				result = await result
+			elif isinstance(result, concurrent.futures.Future):
+				# a job of a thread pool, e.g. downloadPool
+				result = await asyncio.wrap_future(result)
+		else:
+			print(json.dumps(rMessage))
+
+		if metrics is not None:
+			metrics.observe('decrypt', decryptTime)
+			metrics.observe('parse', parseTime)
+			metrics.observe('store', storeTime)
+			# includes the time the coroutine of the callback was awaited
+			metrics.observe('callback', time.perf_counter() - stored)
+
+		print("\n")
+		if result is False:
+			# e.g. the report download failed, the message is processed again
+			return
+		if dedupe is not None:
+			await loop.run_in_executor(None, dedupe.add, messageId, documentId)
+		if metrics is not None:
+			metrics.observeLag(message)
+		message['_processed'] = True
+	except Exception as err:
+		traceback.print_exc()
+		print(err)
+	finally:
+		slots.release()
+		# a message is acknowledged only once its processing has finished
+		await deleteQueue.put(message)
+
+
+#==============================================
+async def startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey, subscriptionId, isRawResponse, callback=None, fileType=None, batchSize=1, concurrency=DEFAULT_CONCURRENCY, highWater=None, lowWater=None, session=None, logOptions=None, sinkOptions=None, visibilityTimeout=None, dedupeOptions=None, credentials=None, metricsOptions=None, client=None):
+#==============================================
+	destinationFolder = sqsQueue.createDestinationFolder(subscriptionId)
+	metrics = pipelineMetrics.forSubscription(subscriptionId)
+	pipelineMetrics.startExporters(metricsOptions)
+	store, closeables, durable = sqsQueue.createStore(destinationFolder, subscriptionId, logOptions, sinkOptions, metrics)
+	beforeDelete = store.flush if durable else None
+	batchSize = max(1, min(batchSize, sqsQueue.MAX_BATCH_SIZE))
+	stats = {'messages': 0, 'apiCalls': 0, 'duplicates': 0}
+	dedupe = sqsQueue.createDedupe(destinationFolder, dedupeOptions)
+	if dedupe is not None:
+		closeables.append(dedupe)
+	if session is None:
+		session = get_session()
+
+	# the heartbeat is driven by a task of this loop rather than its own thread
+	heartbeat = None
+	receiveOptions = {'AttributeNames': sqsQueue.RECEIVE_ATTRIBUTES}
+	if visibilityTimeout:
+		heartbeat = visibilityHeartbeat.VisibilityHeartbeat(None, endpoint, visibilityTimeout)
+		receiveOptions['VisibilityTimeout'] = visibilityTimeout
+
+	# a given client is an async context manager, e.g. the local stand-in of sqsBenchmark.py
+	if client is None and credentials is not None:
+		# a credentialManager.CredentialManager, the client is swapped when the credentials rotate
+		client = RotatingClient(session, credentials)
+	elif client is None:
+		client = _createSqsClient(session, accessID, secretKey, sessionToken)
+
+	async with client as sqs:
+
+		async def acknowledge(messages):
+			metrics.count('errors', sum(1 for message in messages if not message.get('_processed', True)))
+			start = time.perf_counter()
+			try:
+				await _acknowledgeMessages(sqs, endpoint, messages, stats, beforeDelete, heartbeat)
+			finally:
+				await flow.release(len(messages))
+			metrics.observe('delete', (time.perf_counter() - start) / len(messages), len(messages))
+
+		decryptor = sqsQueue.Decryptor(cryptographyKey)
+		slots = asyncio.Semaphore(concurrency)
+		# by default the messages being processed plus a batch waiting to be deleted
+		flow = backpressure.AsyncFlowControl(highWater or concurrency + batchSize, lowWater, metrics)
+		deleteQueue = asyncio.Queue()
+		deleter = asyncio.ensure_future(_deleteWorker(deleteQueue, acknowledge, batchSize, stats))
+		heartbeatTask = asyncio.ensure_future(_heartbeatWorker(sqs, endpoint, heartbeat)) if heartbeat is not None else None
+		backlogInterval = (metricsOptions or {}).get('backlogInterval', pipelineMetrics.DEFAULT_BACKLOG_INTERVAL)
+		backlogTask = asyncio.ensure_future(_backlogWorker(sqs, endpoint, metrics, backlogInterval)) if metricsOptions and backlogInterval else None
+		tasks = set()
+
+		print('Polling messages from queue...')
+		try:
+			while not deleter.done():
+				# waits while too many messages are not acknowledged yet, the backlog stays in the queue
+				maxMessages = await flow.admit(batchSize)
+				start = time.perf_counter()
+				resp = await sqs.receive_message(QueueUrl = endpoint, WaitTimeSeconds = sqsQueue.WAIT_TIME_SECONDS, MaxNumberOfMessages = maxMessages, **receiveOptions)
+				metrics.observe('receive', time.perf_counter() - start)
+				stats['apiCalls'] += 1
+				messages = resp.get('Messages', [])
+				flow.add(len(messages))
+				metrics.count('messages', len(messages))
+				metrics.count('bytes', sum(len(message['Body']) for message in messages))
+				if heartbeat is not None:
+					heartbeat.track(messages)
+				for message in messages:
+					stats['messages'] += 1
+					# wait for a free slot, when highWater is above the concurrency
+					await slots.acquire()
+					task = asyncio.ensure_future(_processMessage(message, deleteQueue, slots, decryptor, subscriptionId,
+						fileType, destinationFolder, isRawResponse, callback, store, dedupe, stats, metrics))
+					tasks.add(task)
+					task.add_done_callback(tasks.discard)
+			# surface the error of the delete stage
+			deleter.result()
+		except asyncio.CancelledError:
+			# unacknowledged messages become visible on the queue again
+			for task in list(tasks) + [deleter]:
+				task.cancel()
+			raise
+		except Exception:
+			# let the received messages finish, then drain the acknowledger
+			if tasks:
+				await asyncio.gather(*tasks, return_exceptions = True)
+			if not deleter.done():
+				await deleteQueue.put(None)
+				await asyncio.gather(deleter, return_exceptions = True)
+			raise
+		finally:
+			if backlogTask is not None:
+				backlogTask.cancel()
+			if heartbeatTask is not None:
+				heartbeatTask.cancel()
+				handles = heartbeat.pendingHandles()
+				if handles:
+					try:
+						# do not leave what was received but not processed invisible until the timeout
+						print("Releasing %d unprocessed messages back to the queue" % len(handles))
+						await _changeVisibility(sqs, endpoint, handles, 0)
+					except Exception as err:
+						print("Unable to release messages: %s" % err)
+			for closeable in closeables:
+				await asyncio.get_event_loop().run_in_executor(None, closeable.close)
+
+
+#==============================================
+async def pollQueue(http, endpoint, cryptographyKey, subscriptionId, isRawResponse=False, callback=None, fileType=None, **pollOptions):
+#==============================================
+	# renewed by a task of this loop ahead of the expiry, the poller keeps running across rotations
+	print("Getting credentials to connect to AWS Queue...")
+	credentials = credentialManager.CredentialManager(None)
+	credentials.update(await requestCloudCredentials(http, endpoint))
+	refresher = asyncio.ensure_future(_credentialWorker(http, endpoint, credentials))
+	try:
+		while 1:
+			try:
+				accessID, secretKey, sessionToken = credentials.current()
+				print("Queue access ID: %s" % (accessID))
+				await startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey, subscriptionId, isRawResponse,
+					callback, fileType, credentials = credentials, **pollOptions)
+			except ClientError as e:
+				print("Cloud credentials exprired!")
+				credentials.update(await requestCloudCredentials(http, endpoint))
+	finally:
+		refresher.cancel()
+
+
+#==============================================
+async def startResearchAlerts(downloadReports, subscriptionId=None, isRawResponse=False, fileType='pdf', **pollOptions):
+#==============================================
+	async with createHttpSession() as http:
+		print("Subscribing to research stream ...")
+		if subscriptionId is None:
+			endpoint, cryptographyKey, subscriptionId = await subscribeToResearch(http)
+		else:
+			endpoint, cryptographyKey, currentSubscriptionID = await getResearchSubscription(http, subscriptionId)
+			if currentSubscriptionID is None:
+				raise Exception("subscriptionID {0} is not found".format(subscriptionId))
+
+		print("  Queue endpoint: %s" % (endpoint))
+		print("  Subscription ID: %s" % (subscriptionId))
+
+		callback = None
+		if downloadReports:
+			researchMessages.create_download_report_folder(researchMessages.REPORTS_DIR_NAME)
+			researchMessages.create_download_report_folder("{}/{}".format(researchMessages.REPORTS_DIR_NAME, subscriptionId))
+			callback = functools.partial(downloadReport, http)
+
+		await pollQueue(http, endpoint, cryptographyKey, subscriptionId, isRawResponse, callback, fileType, **pollOptions)
+
+
+#==============================================
+async def startNewsMessages(headlines=True, **pollOptions):
+#==============================================
+	async with createHttpSession() as http:
+		endpoint, cryptographyKey, subscriptionId = await subscribeToNews(http, headlines)
+		print("  Queue endpoint: %s" % (endpoint))
+		print("  Subscription ID: %s" % (subscriptionId))
+		await pollQueue(http, endpoint, cryptographyKey, subscriptionId, **pollOptions)
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	print("asyncMessages module provides the asyncio API, e.g. asyncio.run(asyncMessages.startResearchAlerts(True, subscriptionId))")
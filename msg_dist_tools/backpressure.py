@@ -0,0 +1,99 @@
+#=============================================================================
+# Backpressure between the SQS receiver and the slower stages of the pipeline
+# Counts the messages which were received but not acknowledged yet. Once the count reaches
+# the high-water mark the receiver stops pulling from SQS until it falls to the low-water
+# mark, so a backlog stays in the queue instead of piling up in memory. The time the
+# receiver spends waiting is recorded as blocked time of its stage
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import threading
+import time
+
+
+#==============================================
+def waterMarks(highWater, lowWater=None):
+#==============================================
+	# receiving resumes at half the high-water mark unless told otherwise
+	highWater = max(1, highWater)
+	if lowWater is None:
+		lowWater = highWater // 2
+	return highWater, max(0, min(lowWater, highWater - 1))
+
+
+#==============================================
+class FlowControl:
+#==============================================
+	def __init__(self, highWater, lowWater=None, metrics=None, stage='receive'):
+		self.highWater, self.lowWater = waterMarks(highWater, lowWater)
+		self.metrics = metrics
+		self.stage = stage
+		self.pending = 0
+		self.paused = False
+		self.condition = threading.Condition()
+
+	def admit(self, batchSize):
+		# returns how many messages may be received, waits while the buffers are full
+		with self.condition:
+			if self.pending >= self.highWater:
+				self.paused = True
+			if self.paused:
+				start = time.perf_counter()
+				while self.pending > self.lowWater:
+					self.condition.wait()
+				self.paused = False
+				if self.metrics is not None:
+					self.metrics.addBlocked(self.stage, time.perf_counter() - start)
+			return min(batchSize, self.highWater - self.pending)
+
+	def add(self, count):
+		with self.condition:
+			self.pending += count
+			self._report()
+
+	def release(self, count):
+		# called once the messages are acknowledged, deleted or returned to the queue
+		with self.condition:
+			self.pending -= count
+			self._report()
+			self.condition.notify_all()
+
+	def _report(self):
+		if self.metrics is not None:
+			self.metrics.setGauge('buffered_messages', self.pending)
+
+
+#==============================================
+class AsyncFlowControl(FlowControl):
+#==============================================
+	# the same for asyncMessages, admit is awaited on the loop and only the loop calls add and release
+	def __init__(self, highWater, lowWater=None, metrics=None, stage='receive'):
+		# imported here, the threaded tools load this module without needing asyncio
+		import asyncio
+		FlowControl.__init__(self, highWater, lowWater, metrics, stage)
+		self.condition = asyncio.Condition()
+
+	async def admit(self, batchSize):
+		async with self.condition:
+			if self.pending >= self.highWater:
+				self.paused = True
+			if self.paused:
+				start = time.perf_counter()
+				while self.pending > self.lowWater:
+					await self.condition.wait()
+				self.paused = False
+				if self.metrics is not None:
+					self.metrics.addBlocked(self.stage, time.perf_counter() - start)
+			return min(batchSize, self.highWater - self.pending)
+
+	def add(self, count):
+		self.pending += count
+		self._report()
+
+	async def release(self, count):
+		async with self.condition:
+			self.pending -= count
+			self._report()
+			self.condition.notify_all()
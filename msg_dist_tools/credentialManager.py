@@ -0,0 +1,130 @@
+#=============================================================================
+# Cloud credential rotation for the SQS pollers
+# The STS credentials returned by /auth/cloud-credentials expire. The manager fetches new
+# ones from a background thread ahead of the expiry, and RotatingClient swaps the SQS
+# client under the running poller, so polling continues across rotations without a gap
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import calendar
+import threading
+import time
+import traceback
+
+# credentials are refreshed this many seconds before they expire
+DEFAULT_REFRESH_MARGIN = 300
+# assumed lifetime when the response has no usable expiration
+DEFAULT_LIFETIME = 3600
+# wait between attempts when a refresh fails
+RETRY_SECONDS = 15
+
+
+#==============================================
+def parseExpiration(value):
+#==============================================
+	# e.g. 2021-06-01T12:00:00.000Z, returns seconds since the epoch or None
+	try:
+		return float(calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")))
+	except (TypeError, ValueError):
+		return None
+
+
+#==============================================
+class CredentialManager:
+#==============================================
+	# fetch returns the "credentials" object of the cloud-credentials response,
+	# it may be None when the caller drives the refresh itself through update, e.g. from asyncio
+	def __init__(self, fetch, refreshMargin=DEFAULT_REFRESH_MARGIN):
+		self.fetch = fetch
+		self.refreshMargin = refreshMargin
+		self.lock = threading.Lock()
+		self.listeners = []
+		self.credentials = None
+		self.fetchedAt = 0
+		self.expiresAt = 0
+		self.stopEvent = threading.Event()
+		self.thread = None
+
+	def start(self):
+		# the first credentials are fetched right away, the renewals in the background
+		self.refresh()
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	def current(self):
+		with self.lock:
+			return self.credentials
+
+	def subscribe(self, listener):
+		# listener(accessID, secretKey, sessionToken) is called on the refresh thread after each rotation
+		with self.lock:
+			self.listeners.append(listener)
+
+	def unsubscribe(self, listener):
+		with self.lock:
+			if listener in self.listeners:
+				self.listeners.remove(listener)
+
+	def refresh(self):
+		return self.update(self.fetch())
+
+	def update(self, jCredentials):
+		credentials = (jCredentials["accessKeyId"], jCredentials["secretKey"], jCredentials["sessionToken"])
+		now = time.time()
+		expiresAt = parseExpiration(jCredentials.get("expiration")) or now + DEFAULT_LIFETIME
+		with self.lock:
+			self.credentials = credentials
+			self.fetchedAt = now
+			self.expiresAt = expiresAt
+			listeners = list(self.listeners)
+		print("Cloud credentials %s valid until %s" % (credentials[0], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(expiresAt))))
+		for listener in listeners:
+			listener(*credentials)
+		return credentials
+
+	def secondsUntilRefresh(self):
+		with self.lock:
+			# never earlier than half way through short lived credentials
+			refreshAt = max(self.expiresAt - self.refreshMargin, self.fetchedAt + (self.expiresAt - self.fetchedAt) / 2.0)
+		# do not hammer the endpoint when the expiration is off, e.g. a skewed clock
+		return max(RETRY_SECONDS, refreshAt - time.time())
+
+	def close(self):
+		self.stopEvent.set()
+		if self.thread is not None:
+			self.thread.join()
+
+	def _run(self):
+		delay = self.secondsUntilRefresh()
+		while not self.stopEvent.wait(delay):
+			try:
+				self.refresh()
+				delay = self.secondsUntilRefresh()
+			except Exception as err:
+				# the current credentials stay in use until they expire
+				traceback.print_exc()
+				print("Unable to refresh cloud credentials: %s" % err)
+				delay = RETRY_SECONDS
+
+
+#==============================================
+class RotatingClient:
+#==============================================
+	# forwards to the current SQS client, which is replaced whenever the credentials rotate
+	def __init__(self, credentials, createClient):
+		self.credentials = credentials
+		self.createClient = createClient
+		self.client = createClient(*credentials.current())
+		credentials.subscribe(self._rotate)
+
+	def _rotate(self, accessID, secretKey, sessionToken):
+		# built on the refresh thread, calls in flight finish on the previous client
+		self.client = self.createClient(accessID, secretKey, sessionToken)
+
+	def close(self):
+		self.credentials.unsubscribe(self._rotate)
+
+	def __getattr__(self, name):
+		return getattr(self.client, name)
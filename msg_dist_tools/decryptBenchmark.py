@@ -0,0 +1,64 @@
+#=============================================================================
+# Microbenchmark of the SQS message decryption
+# Compares sqsQueue.decrypt with the reusable sqsQueue.Decryptor on 1 KB and 100 KB payloads
+#	python decryptBenchmark.py [number of messages]
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import base64
+import os
+import sys
+import timeit
+from Crypto.Cipher import AES
+import sqsQueue
+
+PAYLOAD_SIZES = [1024, 100 * 1024]
+REPEAT = 5
+
+
+#==============================================
+def encrypt(key, plainText):
+#==============================================
+	# same layout as the messages published to the queue
+	aad = os.urandom(sqsQueue.GCM_AAD_LENGTH)
+	cipher = AES.new(key, AES.MODE_GCM, nonce = aad[-sqsQueue.GCM_NONCE_LENGTH:])
+	cipher.update(aad)
+	encMessage, tag = cipher.encrypt_and_digest(plainText)
+	return base64.b64encode(aad + encMessage + tag).decode()
+
+
+#==============================================
+def runBenchmark(payloadSize, count):
+#==============================================
+	key = os.urandom(32)
+	b64Key = base64.b64encode(key).decode()
+	messages = [encrypt(key, os.urandom(payloadSize)) for i in range(count)]
+	decryptor = sqsQueue.Decryptor(b64Key)
+
+	# both must produce the same plain text
+	assert decryptor.decrypt(messages[0]) == sqsQueue.decrypt(b64Key, messages[0])
+
+	results = [
+		("decrypt()", lambda: [sqsQueue.decrypt(b64Key, m) for m in messages]),
+		("Decryptor.decrypt()", lambda: [decryptor.decrypt(m) for m in messages]),
+		("Decryptor.decrypt_many()", lambda: decryptor.decrypt_many(messages))
+	]
+	baseline = None
+	for name, fn in results:
+		best = min(timeit.repeat(fn, number = 1, repeat = REPEAT))
+		perMessage = best / count * 1e6
+		if baseline is None:
+			baseline = perMessage
+		print("%7d bytes  %-26s %9.2f us/message  %6.2fx" % (payloadSize, name, perMessage, baseline / perMessage))
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	print("Decrypting %d messages per run, best of %d runs" % (count, REPEAT))
+	for payloadSize in PAYLOAD_SIZES:
+		runBenchmark(payloadSize, count)
@@ -0,0 +1,95 @@
+#=============================================================================
+# Dedupe cache for redelivered messages
+# SQS delivers at least once, and messages are read again after a restart. The cache
+# remembers recently processed SQS MessageIds and research DocumentIds in a bounded LRU,
+# backed by an on-disk set (dbm), so duplicates are acknowledged without processing them again
+#	metadata/<subscriptionId>/dedupe.db
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import collections
+import dbm
+import threading
+import time
+
+DEDUPE_FILE_NAME = "dedupe.db"
+# entries kept in memory, and how long entries are kept on disk
+DEFAULT_SIZE = 10000
+DEFAULT_MAX_AGE = 14 * 24 * 3600
+
+
+#==============================================
+def documentIdOf(rMessage):
+#==============================================
+	# research alerts carry the DocumentId of the report, news messages do not
+	payload = rMessage.get("payload") if isinstance(rMessage, dict) else None
+	if isinstance(payload, dict) and payload.get("DocumentId"):
+		return str(payload["DocumentId"])
+	return None
+
+
+#==============================================
+def _keys(messageId, documentId):
+#==============================================
+	keys = []
+	if messageId:
+		keys.append("msg:" + messageId)
+	if documentId:
+		keys.append("doc:" + documentId)
+	return keys
+
+
+#==============================================
+class DedupeCache:
+#==============================================
+	# without a path only the in-memory LRU is used
+	def __init__(self, path=None, size=DEFAULT_SIZE, maxAge=DEFAULT_MAX_AGE):
+		self.size = size
+		self.maxAge = maxAge
+		self.lock = threading.Lock()
+		self.recent = collections.OrderedDict()
+		self.db = None
+		if path is not None:
+			self.db = dbm.open(path, 'c')
+			self._prune()
+
+	def _prune(self):
+		# drop the entries which are too old to be redelivered, once at startup
+		cutoff = time.time() - self.maxAge
+		for key in list(self.db.keys()):
+			if float(self.db[key]) < cutoff:
+				del self.db[key]
+
+	def _remember(self, key):
+		self.recent[key] = True
+		self.recent.move_to_end(key)
+		if len(self.recent) > self.size:
+			self.recent.popitem(last = False)
+
+	def seen(self, messageId=None, documentId=None):
+		keys = _keys(messageId, documentId)
+		if not keys:
+			return False
+		with self.lock:
+			for key in keys:
+				# the disk is only read on a miss of the LRU
+				if key in self.recent or (self.db is not None and key in self.db):
+					self._remember(key)
+					return True
+		return False
+
+	def add(self, messageId=None, documentId=None):
+		now = str(time.time())
+		with self.lock:
+			for key in _keys(messageId, documentId):
+				self._remember(key)
+				if self.db is not None:
+					self.db[key] = now
+
+	def close(self):
+		with self.lock:
+			if self.db is not None:
+				self.db.close()
+				self.db = None
@@ -0,0 +1,165 @@
+#=============================================================================
+# Durable queue of report downloads
+# The poller records a job for each research alert in a SQLite file before the message is
+# deleted from SQS, and a pool of workers downloads the reports. Each job is pending,
+# in_progress, done or failed. A failed download is retried with exponential backoff and
+# given up after maxAttempts. Jobs which were in progress when the process died are
+# pending again after a restart and resumed by all workers in parallel
+#	metadata/<subscriptionId>/downloads.db
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import json
+import random
+import sqlite3
+import threading
+import time
+import traceback
+import dedupeCache
+
+JOBS_FILE_NAME = "downloads.db"
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled with each attempt up to MAX_BACKOFF
+BASE_BACKOFF = 30
+MAX_BACKOFF = 3600
+# seconds an idle worker waits before looking for due retries again
+IDLE_WAIT = 5
+# done and failed jobs are kept this long, a redelivered alert of a done job is not downloaded again
+DEFAULT_MAX_AGE = 14 * 24 * 3600
+
+
+#==============================================
+def backoff(attempts):
+#==============================================
+	# with jitter, so jobs which failed together are not retried together
+	return min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+#==============================================
+class DownloadJobs:
+#==============================================
+	# download(rMessage, subscriptionId, fileType, isRawResponse) returns False or raises when the
+	# report could not be downloaded, metrics is a pipelineMetrics.PipelineMetrics
+	def __init__(self, path, download, workers=DEFAULT_WORKERS, maxAttempts=DEFAULT_MAX_ATTEMPTS, metrics=None, maxAge=DEFAULT_MAX_AGE):
+		self.download = download
+		self.maxAttempts = maxAttempts
+		self.metrics = metrics
+		self.lock = threading.Lock()
+		self.condition = threading.Condition(self.lock)
+		self.stopping = False
+		self.db = sqlite3.connect(path, check_same_thread = False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS jobs (documentId TEXT, fileType TEXT, subscriptionId TEXT, isRawResponse INTEGER, "
+				"message TEXT, state TEXT, attempts INTEGER, nextAttempt REAL, error TEXT, created REAL, updated REAL, "
+				"PRIMARY KEY (documentId, fileType))")
+			self.db.execute("CREATE INDEX IF NOT EXISTS dueJobs ON jobs (state, nextAttempt)")
+			# the process died while these were downloaded
+			resumed = self.db.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, IN_PROGRESS)).rowcount
+			self.db.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?", (DONE, FAILED, time.time() - maxAge))
+		pending = self.counts().get(PENDING, 0)
+		if pending:
+			print("Resuming %d report downloads, %d of them were interrupted" % (pending, resumed))
+		self._report()
+		self.threads = []
+		for i in range(workers):
+			thread = threading.Thread(target = self._run, name = "download-%d" % i, daemon = True)
+			thread.start()
+			self.threads.append(thread)
+
+	def enqueue(self, rMessage, subscriptionId, fileType, isRawResponse):
+		# a callback for sqsQueue.startPolling, the job is committed before the message is deleted
+		now = time.time()
+		key = (str(dedupeCache.documentIdOf(rMessage)), fileType or "")
+		with self.condition:
+			with self.db:
+				row = self.db.execute("SELECT state FROM jobs WHERE documentId = ? AND fileType = ?", key).fetchone()
+				if row is not None and row[0] != FAILED:
+					# queued, running or downloaded already
+					return
+				# new, or a failed report alerted again is given another round of attempts
+				self.db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, 0, ?, NULL, ?, ?)",
+					key + (subscriptionId, int(bool(isRawResponse)), json.dumps(rMessage), PENDING, now, now, now))
+			self._report()
+			self.condition.notify()
+
+	def _claim(self):
+		# the next due job, marked in progress, or None after waiting for one
+		with self.condition:
+			while not self.stopping:
+				now = time.time()
+				row = self.db.execute("SELECT documentId, fileType, subscriptionId, isRawResponse, message, attempts FROM jobs "
+					"WHERE state = ? AND nextAttempt <= ? ORDER BY nextAttempt LIMIT 1", (PENDING, now)).fetchone()
+				if row is not None:
+					# counted when started, so a job which brings the process down is given up eventually
+					with self.db:
+						self.db.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE documentId = ? AND fileType = ?",
+							(IN_PROGRESS, now, row[0], row[1]))
+					self._report()
+					return row
+				due = self.db.execute("SELECT MIN(nextAttempt) FROM jobs WHERE state = ?", (PENDING,)).fetchone()[0]
+				self.condition.wait(IDLE_WAIT if due is None else min(IDLE_WAIT, due - now))
+			return None
+
+	def _finish(self, documentId, fileType, attempts, error):
+		now = time.time()
+		if error is None:
+			state, nextAttempt = DONE, now
+		elif attempts >= self.maxAttempts:
+			state, nextAttempt = FAILED, now
+			print("Giving up the report %s after %d attempts: %s" % (documentId, attempts, error))
+		else:
+			state, nextAttempt = PENDING, now + backoff(attempts)
+			print("Report %s will be downloaded again in %d seconds: %s" % (documentId, nextAttempt - now, error))
+		with self.condition:
+			with self.db:
+				self.db.execute("UPDATE jobs SET state = ?, nextAttempt = ?, error = ?, updated = ? WHERE documentId = ? AND fileType = ?",
+					(state, nextAttempt, error, now, documentId, fileType))
+			self._report()
+
+	def _run(self):
+		while 1:
+			job = self._claim()
+			if job is None:
+				break
+			documentId, fileType, subscriptionId, isRawResponse, message, attempts = job
+			start = time.perf_counter()
+			error = None
+			try:
+				if self.download(json.loads(message), subscriptionId, fileType or None, bool(isRawResponse)) is False:
+					error = "download failed"
+			except Exception as err:
+				traceback.print_exc()
+				error = str(err) or err.__class__.__name__
+			if self.metrics is not None:
+				self.metrics.observe('download', time.perf_counter() - start)
+				if error is not None:
+					self.metrics.count('errors')
+			self._finish(documentId, fileType, attempts + 1, error)
+
+	def counts(self):
+		# state -> number of jobs
+		with self.lock:
+			return dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+	def _report(self):
+		# called holding the lock
+		if self.metrics is not None:
+			count = self.db.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (PENDING, IN_PROGRESS)).fetchone()[0]
+			self.metrics.setGauge('pending_downloads', count)
+
+	def close(self):
+		# lets the running downloads finish, pending jobs are resumed on the next start
+		with self.condition:
+			self.stopping = True
+			self.condition.notify_all()
+		for thread in self.threads:
+			thread.join()
+		with self.lock:
+			self.db.close()
@@ -0,0 +1,65 @@
+#=============================================================================
+# Report download pool, decoupled from polling the queue
+# The poller hands each report download to the pool and goes on receiving. At most maxPending
+# downloads are queued or running, beyond that submitting waits, which holds back the poller.
+# The downloads share the keep-alive connections of rdpClient. The returned future tells
+# sqsQueue when the message can be acknowledged
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import concurrent.futures
+import threading
+import time
+import traceback
+
+DEFAULT_WORKERS = 8
+
+
+#==============================================
+class DownloadPool:
+#==============================================
+	# metrics is a pipelineMetrics.PipelineMetrics, download times and the time submit waits are recorded
+	def __init__(self, workers=DEFAULT_WORKERS, maxPending=None, metrics=None):
+		self.workers = workers
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "download")
+		# a few waiting jobs keep the workers busy between two receives
+		self.slots = threading.BoundedSemaphore(maxPending or 2 * workers)
+		self.metrics = metrics
+
+	def submit(self, fn, *args):
+		if not self.slots.acquire(blocking = False):
+			start = time.perf_counter()
+			self.slots.acquire()
+			if self.metrics is not None:
+				self.metrics.addBlocked('download', time.perf_counter() - start)
+		try:
+			job = self.executor.submit(self._run, fn, args)
+		except Exception:
+			self.slots.release()
+			raise
+		job.add_done_callback(lambda job: self.slots.release())
+		return job
+
+	def wrap(self, fn):
+		# a callback for sqsQueue.startPolling which runs fn in the pool
+		def submitJob(*args):
+			return self.submit(fn, *args)
+		return submitJob
+
+	def _run(self, fn, args):
+		start = time.perf_counter()
+		try:
+			return fn(*args)
+		except Exception:
+			# the future carries the error, print it where it happened
+			traceback.print_exc()
+			raise
+		finally:
+			if self.metrics is not None:
+				self.metrics.observe('download', time.perf_counter() - start)
+
+	def close(self):
+		# lets the submitted downloads finish
+		self.executor.shutdown(wait = True)
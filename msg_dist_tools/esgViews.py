@@ -5,7 +5,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 import sys
@@ -84,7 +84,7 @@ if __name__ == "__main__":
 		#"format": "noMessages"
 	}
 
-	dResp = requests.get(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = requestData)
+	dResp = rdpClient.get(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = requestData)
 
 	if dResp.status_code != 200:
 		print("Unable to get data. Code %s, Message: %s" % (dResp.status_code, dResp.text))
@@ -5,7 +5,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 
@@ -35,7 +35,7 @@ def requestSearch(searchPayload):
 		'cache-control': "no-cache"
 	}
 
-	sResp = requests.post(RESOURCE_ENDPOINT, headers=hdrs, data = json.dumps(requestData))
+	sResp = rdpClient.post(RESOURCE_ENDPOINT, headers=hdrs, data = json.dumps(requestData))
 
 	if sResp.status_code != 200:
 		raise ValueError("Unable to search. Code %s, Message: %s" % (sResp.status_code, sResp.text))
@@ -60,7 +60,7 @@ def retrieveDocURL(documentID):
 		"ClientID" : DOC_CLIENT_ID
 	}
 
-	rResp = requests.get(RESOURCE_ENDPOINT, headers = hdrs)
+	rResp = rdpClient.get(RESOURCE_ENDPOINT, headers = hdrs)
 
 	if rResp.status_code != 200:
 		raise ValueError("Unable to get document URL. Code %s, Message: %s" % (rResp.status_code, rResp.text))
@@ -74,15 +74,12 @@ def retrieveDocURL(documentID):
 #==============================================
 def retrieveSaveDoc(fileName, signedUrl):
 #==============================================
-	dResp = requests.get(signedUrl, allow_redirects=True)
+	# streamed to disk in chunks, an interrupted download is resumed from where it stopped
+	saved, dResp = rdpClient.download(signedUrl, fileName, allow_redirects=True)
 
-	if dResp.status_code != 200:
-		raise ValueError("Unable to download the document. Response: " % (dResp.status_code, dResp.text))
+	if not saved:
+		raise ValueError("Unable to download the document. Code %s, Message: %s" % (dResp.status_code, dResp.text))
 	else:
-		with open(fileName, 'wb') as f:
-			f.write(dResp.content)
-			f.close()
-		
 		print("The document [%s], has been downloaded" % fileName)
 
 
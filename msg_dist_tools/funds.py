@@ -5,7 +5,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 
@@ -25,7 +25,7 @@ def getFundData(requestPayload):
 	print("Getting OAuth access token...")
 	accessToken = rdpToken.getToken()
 	
-	dResp = requests.get(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = requestPayload)
+	dResp = rdpClient.get(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = requestPayload)
 
 	if dResp.status_code != 200:
 		print("Unable to get data. Code %s, Message: %s" % (dResp.status_code, dResp.text))
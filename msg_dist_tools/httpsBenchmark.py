@@ -0,0 +1,88 @@
+#=============================================================================
+# Benchmark of the shared keep-alive session against a new connection per call
+# Starts a local HTTPS server as a stand-in for api.refinitiv.com and times the same GET
+# with requests.get, which opens a new TCP and TLS connection each time, and with rdpClient
+#	python httpsBenchmark.py [number of calls]
+# A self signed certificate is created with the openssl command line tool
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import http.server
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+import rdpClient
+
+RESPONSE = b'{"data": []}'
+
+
+#==============================================
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+#==============================================
+	# HTTP/1.1 keeps the connection open between requests
+	protocol_version = "HTTP/1.1"
+	# headers and body are written separately, do not let them wait for a delayed ACK
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(RESPONSE)))
+		self.end_headers()
+		self.wfile.write(RESPONSE)
+
+	def log_message(self, format, *args):
+		pass
+
+
+#==============================================
+def startServer(folder):
+#==============================================
+	certFile = os.path.join(folder, "cert.pem")
+	keyFile = os.path.join(folder, "key.pem")
+	subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+		"-addext", "subjectAltName=IP:127.0.0.1", "-keyout", keyFile, "-out", certFile],
+		check = True, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+	server.daemon_threads = True
+	context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+	context.load_cert_chain(certFile, keyFile)
+	server.socket = context.wrap_socket(server.socket, server_side = True)
+	threading.Thread(target = server.serve_forever, daemon = True).start()
+	return server, certFile
+
+
+#==============================================
+def timeCalls(name, get, url, certFile, count):
+#==============================================
+	# the first call opens the pooled connection, it is not counted
+	get(url, verify = certFile).raise_for_status()
+	start = time.perf_counter()
+	for i in range(count):
+		get(url, verify = certFile).raise_for_status()
+	perCall = (time.perf_counter() - start) / count * 1000
+	print("%-26s %8.3f ms/call" % (name, perCall))
+	return perCall
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	with tempfile.TemporaryDirectory() as folder:
+		server, certFile = startServer(folder)
+		url = "https://127.0.0.1:%d/data/v1/" % server.server_address[1]
+		print("%d GET calls to %s" % (count, url))
+		fresh = timeCalls("requests.get", requests.get, url, certFile, count)
+		pooled = timeCalls("rdpClient.get (keep-alive)", rdpClient.get, url, certFile, count)
+		print("Saved %.3f ms per call (%.1fx)" % (fresh - pooled, fresh / pooled))
+		server.shutdown()
@@ -5,7 +5,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 import sys
@@ -76,7 +76,7 @@ if __name__ == "__main__":
 		"Content-Type": "application/json"
 	}
 
-	dResp = requests.post(RESOURCE_ENDPOINT, headers = hdrs, data = json.dumps(requestData))
+	dResp = rdpClient.post(RESOURCE_ENDPOINT, headers = hdrs, data = json.dumps(requestData))
 
 	if dResp.status_code != 200:
 		print("Unable to get data. Code %s, Message: %s" % (dResp.status_code, dResp.text))
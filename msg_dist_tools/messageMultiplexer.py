@@ -0,0 +1,151 @@
+#=============================================================================
+# Refinitiv Data Platform demo app to poll several news and research subscriptions
+# from a single process. All queues are polled concurrently on one asyncio event loop,
+# sharing one HTTP session, one AWS session and the same access token.
+# Subscriptions are read from subscriptions.ini
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import asyncio
+import configparser
+import functools
+import sys
+import traceback
+import argparse
+from aiobotocore.session import get_session
+import asyncMessages
+import researchMessages
+import sqsQueue
+import metadataLog
+import writeBehind
+import pipelineMetrics
+
+SUBSCRIPTIONS_FILE = "subscriptions.ini"
+
+
+#==============================================
+def loadSubscriptions(fileName=SUBSCRIPTIONS_FILE):
+#==============================================
+	config = configparser.ConfigParser()
+	if not config.read(fileName):
+		raise Exception("Unable to read subscriptions file {}".format(fileName))
+
+	subscriptions = []
+	for name in config.sections():
+		section = config[name]
+		kind = section.get('type', name).lower()
+		if kind not in ('research', 'headlines', 'stories'):
+			raise Exception("Subscription [{}] has unsupported type {}".format(name, kind))
+		pollOptions = {
+			"batchSize": sqsQueue.MAX_BATCH_SIZE if section.getboolean('batch', False) else 1,
+			"concurrency": section.getint('concurrency', asyncMessages.DEFAULT_CONCURRENCY),
+			"visibilityTimeout": section.getint('visibilityTimeout', None),
+			"highWater": section.getint('highWater', None),
+			"lowWater": section.getint('lowWater', None)
+		}
+		if section.get('storage', 'files').lower() == 'jsonl':
+			pollOptions["logOptions"] = {
+				"maxBytes": section.getint('segmentSize', metadataLog.DEFAULT_MAX_BYTES // (1024 * 1024)) * 1024 * 1024,
+				"maxAge": section.getint('segmentAge', metadataLog.DEFAULT_MAX_AGE),
+				"fsync": section.get('fsync', metadataLog.FSYNC_INTERVAL)
+			}
+		if section.getint('dedupe', 0):
+			pollOptions["dedupeOptions"] = {"size": section.getint('dedupe')}
+		if section.getint('metricsPort', 0) or section.get('statsFile'):
+			# shared by the subscriptions, one endpoint and one file serve all of them
+			pollOptions["metricsOptions"] = {
+				"port": section.getint('metricsPort', 0),
+				"statsFile": section.get('statsFile') or None,
+				"interval": section.getint('statsInterval', pipelineMetrics.DEFAULT_STATS_INTERVAL),
+				"backlogInterval": section.getint('backlogInterval', pipelineMetrics.DEFAULT_BACKLOG_INTERVAL)
+			}
+		if section.getboolean('writeBehind', False):
+			pollOptions["sinkOptions"] = {
+				"maxBatch": section.getint('flushCount', writeBehind.DEFAULT_MAX_BATCH),
+				"maxDelay": section.getfloat('flushInterval', writeBehind.DEFAULT_MAX_DELAY),
+				"maxPending": section.getint('maxPending', writeBehind.DEFAULT_MAX_PENDING),
+				"ackPolicy": section.get('ack', writeBehind.ACK_PROCESSED)
+			}
+		subscriptions.append({
+			"name": name,
+			"type": kind,
+			"subscriptionId": section.get('subscriptionId') or None,
+			"report": section.getboolean('report', False),
+			"fileType": section.get('fileType', 'pdf').lower(),
+			"link": section.getboolean('link', False),
+			"pollOptions": pollOptions
+		})
+	return subscriptions
+
+
+#==============================================
+async def runSubscription(http, session, subscription, newsSubscriptions):
+#==============================================
+	name = subscription["name"]
+	try:
+		callback = None
+		fileType = None
+		if subscription["type"] == 'research':
+			if subscription["subscriptionId"] is None:
+				endpoint, cryptographyKey, subscriptionId = await asyncMessages.subscribeToResearch(http)
+			else:
+				endpoint, cryptographyKey, subscriptionId = await asyncMessages.getResearchSubscription(http, subscription["subscriptionId"])
+				if subscriptionId is None:
+					raise Exception("subscriptionID {0} is not found".format(subscription["subscriptionId"]))
+			if subscription["report"]:
+				researchMessages.create_download_report_folder(researchMessages.REPORTS_DIR_NAME)
+				researchMessages.create_download_report_folder("{}/{}".format(researchMessages.REPORTS_DIR_NAME, subscriptionId))
+				callback = functools.partial(asyncMessages.downloadReport, http)
+				fileType = subscription["fileType"]
+		else:
+			headlines = subscription["type"] == 'headlines'
+			endpoint, cryptographyKey, subscriptionId = await asyncMessages.subscribeToNews(http, headlines)
+			# news subscriptions are removed on shutdown, like newsMessages does
+			newsSubscriptions.append((subscriptionId, headlines))
+
+		print("[%s] Queue endpoint: %s" % (name, endpoint))
+		print("[%s] Subscription ID: %s" % (name, subscriptionId))
+		await asyncMessages.pollQueue(http, endpoint, cryptographyKey, subscriptionId, subscription["link"], callback, fileType,
+			session = session, **subscription["pollOptions"])
+	except asyncio.CancelledError:
+		raise
+	except Exception as err:
+		# one broken subscription must not stop the others
+		traceback.print_exc()
+		print("[%s] Subscription stopped: %s" % (name, err))
+
+
+#==============================================
+async def startMultiplexer(subscriptions):
+#==============================================
+	# every queue shares the same AWS session and HTTP connection pool
+	session = get_session()
+	newsSubscriptions = []
+	async with asyncMessages.createHttpSession() as http:
+		try:
+			await asyncio.gather(*[runSubscription(http, session, subscription, newsSubscriptions) for subscription in subscriptions])
+		finally:
+			for subscriptionId, headlines in newsSubscriptions:
+				try:
+					await asyncMessages.removeNewsSubscription(http, subscriptionId, headlines)
+				except Exception as err:
+					print(err)
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	parser = argparse.ArgumentParser(description="Poll all subscriptions listed in a subscriptions file from a single process")
+	parser.add_argument("-f", "--file", default=SUBSCRIPTIONS_FILE, help="subscriptions file, default is {}".format(SUBSCRIPTIONS_FILE))
+	args = parser.parse_args()
+
+	subscriptions = loadSubscriptions(args.file)
+	print("Polling %d subscriptions, press BREAK to exit..." % len(subscriptions))
+	try:
+		asyncio.run(startMultiplexer(subscriptions))
+	except KeyboardInterrupt:
+		print("User requested break, cleaning up...")
+		sys.exit(0)
@@ -0,0 +1,223 @@
+#=============================================================================
+# Append-only segmented log for the received messages
+# Messages are written as compact JSON lines into segment files which are rotated by
+# size or age. A sidecar index per segment maps SQS MessageIds and research DocumentIds
+# to the offset of the record, so records can be looked up without scanning the segments
+#	metadata/<subscriptionId>/segment_<sequence>_<YYYYmmdd-HHMMSS>.jsonl
+#	metadata/<subscriptionId>/segment_<sequence>_<YYYYmmdd-HHMMSS>.idx
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import json
+import os
+import sys
+import time
+import threading
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+# rotate a segment once it is bigger than this or older than this
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 3600
+# fsync policies: after every record, at most once per interval, or leave it to the OS
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+DEFAULT_FSYNC_INTERVAL = 1.0
+
+
+#==============================================
+def _segmentNames(folder):
+#==============================================
+	try:
+		names = os.listdir(folder)
+	except FileNotFoundError:
+		return []
+	# the zero padded sequence number keeps the names in write order
+	return sorted(name[:-len(SEGMENT_SUFFIX)] for name in names if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+
+#==============================================
+def _indexKeys(record):
+#==============================================
+	keys = []
+	if record.get("MessageId"):
+		keys.append("msg:" + record["MessageId"])
+	payload = record["message"].get("payload")
+	if isinstance(payload, dict) and payload.get("DocumentId"):
+		keys.append("doc:" + str(payload["DocumentId"]))
+	return keys
+
+
+#==============================================
+class MetadataLog:
+#==============================================
+	def __init__(self, folder, maxBytes=DEFAULT_MAX_BYTES, maxAge=DEFAULT_MAX_AGE, fsync=FSYNC_INTERVAL, fsyncInterval=DEFAULT_FSYNC_INTERVAL):
+		if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+			raise ValueError("Unknown fsync policy {}".format(fsync))
+		self.folder = folder
+		self.maxBytes = maxBytes
+		self.maxAge = maxAge
+		self.fsync = fsync
+		self.fsyncInterval = fsyncInterval
+		self.lock = threading.Lock()
+		self.segment = None
+		self.index = None
+		names = _segmentNames(folder)
+		self.sequence = int(names[-1].split("_")[1]) if names else 0
+
+	def _open(self):
+		self.sequence += 1
+		name = "{}{:06d}_{}".format(SEGMENT_PREFIX, self.sequence, time.strftime("%Y%m%d-%H%M%S"))
+		self.segment = open(os.path.join(self.folder, name + SEGMENT_SUFFIX), 'ab')
+		self.index = open(os.path.join(self.folder, name + INDEX_SUFFIX), 'ab')
+		self.openedAt = time.time()
+		self.lastSync = self.openedAt
+
+	def _close(self):
+		if self.segment is not None:
+			self._sync()
+			self.segment.close()
+			self.index.close()
+			self.segment = None
+			self.index = None
+
+	def _sync(self):
+		self.segment.flush()
+		self.index.flush()
+		if self.fsync != FSYNC_NEVER:
+			os.fsync(self.segment.fileno())
+			os.fsync(self.index.fileno())
+		self.lastSync = time.time()
+
+	def append(self, rMessage, messageId=None):
+		record = {"MessageId": messageId, "time": time.time(), "message": rMessage}
+		return self.appendMany([record])[0]
+
+	def appendMany(self, records):
+		# records are {"MessageId", "time", "message"} dicts, returns where each one was written
+		locations = []
+		with self.lock:
+			for record in records:
+				if self.segment is None or self.segment.tell() >= self.maxBytes or time.time() - self.openedAt >= self.maxAge:
+					self._close()
+					self._open()
+				offset = self.segment.tell()
+				self.segment.write(json.dumps(record, separators = (',', ':')).encode() + b"\n")
+				for key in _indexKeys(record):
+					self.index.write("{}\t{}\n".format(key, offset).encode())
+				locations.append((os.path.basename(self.segment.name), offset))
+
+			if self.fsync == FSYNC_ALWAYS or (self.fsync == FSYNC_INTERVAL and time.time() - self.lastSync >= self.fsyncInterval):
+				self._sync()
+			else:
+				self.segment.flush()
+				self.index.flush()
+		return locations
+
+	def close(self):
+		with self.lock:
+			self._close()
+
+
+#==============================================
+class MetadataFiles:
+#==============================================
+	# one pretty printed file per message, the default layout of metadata/<subscriptionId>
+	def __init__(self, folder, subscriptionId):
+		self.folder = folder
+		self.subscriptionId = subscriptionId
+
+	def append(self, rMessage, messageId=None):
+		return self.appendMany([{"MessageId": messageId, "time": time.time(), "message": rMessage}])[0]
+
+	def appendMany(self, records):
+		locations = []
+		for record in records:
+			# named after the receive time, also when the write is deferred
+			time_str = time.strftime("%Y%m%d-%H%M%S", time.localtime(record["time"]))
+			fileName = "{}/{}_{}_{}".format(self.folder, self.subscriptionId, time_str, "metadata.json")
+			with open(fileName, 'w') as f:
+				f.write(json.dumps(record["message"], indent=2))
+			locations.append((fileName, 0))
+		return locations
+
+	def close(self):
+		pass
+
+
+#==============================================
+class MetadataLogReader:
+#==============================================
+	def __init__(self, folder):
+		self.folder = folder
+		self.index = None
+
+	def _loadIndex(self):
+		# the sidecar files are small, the segments themselves are never scanned
+		self.index = {}
+		for name in _segmentNames(self.folder):
+			try:
+				with open(os.path.join(self.folder, name + INDEX_SUFFIX), 'r') as f:
+					for line in f:
+						# skip an entry torn by a crash, as records() does
+						if not line.endswith("\n"):
+							continue
+						parts = line[:-1].split("\t")
+						if len(parts) != 2:
+							continue
+						try:
+							self.index[parts[0]] = (name + SEGMENT_SUFFIX, int(parts[1]))
+						except ValueError:
+							continue
+			except FileNotFoundError:
+				pass
+
+	def _read(self, location):
+		with open(os.path.join(self.folder, location[0]), 'rb') as f:
+			f.seek(location[1])
+			return json.loads(f.readline())
+
+	def records(self):
+		for name in _segmentNames(self.folder):
+			with open(os.path.join(self.folder, name + SEGMENT_SUFFIX), 'rb') as f:
+				for line in f:
+					# skip a record torn by a crash
+					if line.endswith(b"\n"):
+						yield json.loads(line)
+
+	def __iter__(self):
+		return self.records()
+
+	def lookup(self, messageId=None, documentId=None):
+		if self.index is None:
+			self._loadIndex()
+		key = "msg:" + messageId if messageId is not None else "doc:" + str(documentId)
+		location = self.index.get(key)
+		if location is None:
+			return None
+		return self._read(location)
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	if len(sys.argv) == 2:
+		for record in MetadataLogReader(sys.argv[1]):
+			print(json.dumps(record))
+	elif len(sys.argv) == 4 and sys.argv[2] in ('-m', '-d'):
+		reader = MetadataLogReader(sys.argv[1])
+		if sys.argv[2] == '-m':
+			record = reader.lookup(messageId = sys.argv[3])
+		else:
+			record = reader.lookup(documentId = sys.argv[3])
+		print(json.dumps(record, indent=2) if record is not None else "Not found")
+	else:
+		print("Arguments:")
+		print("  <folder> Print all records, e.g. metadata/<subscriptionId>")
+		print("  <folder> -m <MessageId> Look up a record by SQS MessageId")
+		print("  <folder> -d <DocumentId> Look up a research record by DocumentId")
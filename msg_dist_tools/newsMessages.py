@@ -5,14 +5,16 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 import sqsQueue
+import credentialManager
+import pipelineMetrics
+import writeBehind
 import atexit
 import sys
-import boto3
-from botocore.exceptions import ClientError
+import getopt
 
 # Application Constants
 base_URL = "https://api.refinitiv.com"
@@ -69,7 +71,7 @@ def subscribeToNews():
 		"Content-Type": "application/json"
 	}
 
-	dResp = requests.post(RESOURCE_ENDPOINT, headers = hdrs, data = json.dumps(requestData))
+	dResp = rdpClient.post(RESOURCE_ENDPOINT, headers = hdrs, data = json.dumps(requestData))
 	if dResp.status_code != 200:
 		raise ValueError("Unable to subscribe. Code %s, Message: %s" % (dResp.status_code, dResp.text))
 	else:
@@ -78,7 +80,7 @@ def subscribeToNews():
 
 
 #==============================================
-def getCloudCredentials(endpoint):
+def requestCloudCredentials(endpoint):
 #==============================================
 	CC_category_URL = "/auth/cloud-credentials"
 	CC_endpoint_URL = "/"
@@ -89,19 +91,29 @@ def getCloudCredentials(endpoint):
 
 	# get the latest access token
 	accessToken = rdpToken.getToken()
-	dResp = requests.get(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = requestData)
+	dResp = rdpClient.get(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = requestData)
 	if dResp.status_code != 200:
 		raise ValueError("Unable to get credentials. Code %s, Message: %s" % (dResp.status_code, dResp.text))
 	else:
 		jResp = json.loads(dResp.text)
-		return jResp["credentials"]["accessKeyId"], jResp["credentials"]["secretKey"], jResp["credentials"]["sessionToken"]
+		# accessKeyId, secretKey, sessionToken and expiration
+		return jResp["credentials"]
 
 
 #==============================================
-def startNewsMessages(headlines = True):
+def getCloudCredentials(endpoint):
+#==============================================
+	jCredentials = requestCloudCredentials(endpoint)
+	return jCredentials["accessKeyId"], jCredentials["secretKey"], jCredentials["sessionToken"]
+
+
+#==============================================
+def startNewsMessages(headlines = True, **pollOptions):
 #==============================================
 	global currentSubscriptionID
 	global gHeadlines
+	# only needed for polling, listing and deleting subscriptions start without botocore
+	from botocore.exceptions import ClientError
 	try:
 		gHeadlines = headlines
 		if gHeadlines:
@@ -116,15 +128,20 @@ def startNewsMessages(headlines = True):
 		# unsubscribe before shutting down
 		atexit.register(removeSubscription)
 
+		# renewed in the background ahead of the expiry, the poller keeps running across rotations
+		print("Getting credentials to connect to AWS Queue...")
+		credentials = credentialManager.CredentialManager(lambda: requestCloudCredentials(endpoint))
+		credentials.start()
 		while 1:
 			try:
-				print("Getting credentials to connect to AWS Queue...")
-				accessID, secretKey, sessionToken = getCloudCredentials(endpoint)
+				accessID, secretKey, sessionToken = credentials.current()
 				print("Queue access ID: %s" % (accessID) )
 				print("Getting news, press BREAK to exit and delete subscription...")
-				sqsQueue.startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey)
+				sqsQueue.startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey, currentSubscriptionID, False,
+					credentials = credentials, **pollOptions)
 			except ClientError as e:
 				print("Cloud credentials exprired!")
+				credentials.refresh()
 	except KeyboardInterrupt:
 		print("User requested break, cleaning up...")
 		sys.exit(0)
@@ -143,10 +160,10 @@ def removeSubscription():
 
 	if currentSubscriptionID:
 		print("Deleting the open subscription")
-		dResp = requests.delete(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = {"subscriptionID": currentSubscriptionID})
+		dResp = rdpClient.delete(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, params = {"subscriptionID": currentSubscriptionID})
 	else:
 		print("Deleting ALL open headline and stories subscription")
-		dResp = requests.delete(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken})
+		dResp = rdpClient.delete(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken})
 
 	if dResp.status_code > 299:
 		print(dResp)
@@ -164,7 +181,7 @@ def showActiveSubscriptions():
 	accessToken = rdpToken.getToken()
 
 	print("Getting all open headlines subscriptions")
-	dResp = requests.get(RESOURCE_ENDPOINT + endpoint_URL_headlines, headers = {"Authorization": "Bearer " + accessToken})
+	dResp = rdpClient.get(RESOURCE_ENDPOINT + endpoint_URL_headlines, headers = {"Authorization": "Bearer " + accessToken})
 
 	if dResp.status_code != 200:
 		raise ValueError("Unable to get subscriptions. Code %s, Message: %s" % (dResp.status_code, dResp.text))
@@ -173,7 +190,7 @@ def showActiveSubscriptions():
 		print(json.dumps(jResp, indent=2))
 
 	print("Getting all open stories subscriptions")
-	dResp = requests.get(RESOURCE_ENDPOINT + endpoint_URL_stories, headers = {"Authorization": "Bearer " + accessToken})
+	dResp = rdpClient.get(RESOURCE_ENDPOINT + endpoint_URL_stories, headers = {"Authorization": "Bearer " + accessToken})
 
 	if dResp.status_code != 200:
 		raise ValueError("Unable to get subscriptions. Code %s, Message: %s" % (dResp.status_code, dResp.text))
@@ -187,17 +204,84 @@ def showActiveSubscriptions():
 if __name__ == "__main__":
 #==============================================
 	if len(sys.argv) > 1:
+		try:
+			opts, args = getopt.getopt(sys.argv[2:], "", ["batch", "workers=", "deleters=", "queue-size=", "low-water=",
+				"jsonl", "segment-size=", "segment-age=", "fsync=",
+				"write-behind", "flush-count=", "flush-interval=", "max-pending=", "ack=", "visibility-timeout=", "dedupe=",
+				"metrics-port=", "stats-file=", "stats-interval=", "backlog-interval="])
+		except getopt.GetoptError:
+			print('Usage: python newsMessages.py <-l|-d|-h|-s> [--batch] [--workers n] [--deleters n] [--queue-size n [--low-water n]] [--jsonl [--segment-size mb] [--segment-age s] [--fsync always|interval|never]] [--write-behind [--flush-count n] [--flush-interval s] [--max-pending n] [--ack processed|durable]] [--visibility-timeout s] [--dedupe size] [--metrics-port port] [--stats-file file [--stats-interval s]] [--backlog-interval s]')
+			sys.exit(2)
+		pollOptions = {}
+		for opt, arg in opts:
+			if opt == "--batch":
+				pollOptions["batchSize"] = sqsQueue.MAX_BATCH_SIZE
+			elif opt == "--workers":
+				pollOptions["workers"] = int(arg)
+			elif opt == "--deleters":
+				pollOptions["deleters"] = int(arg)
+			elif opt == "--queue-size":
+				pollOptions["queueSize"] = int(arg)
+			elif opt == "--low-water":
+				pollOptions["lowWater"] = int(arg)
+			elif opt == "--jsonl":
+				pollOptions.setdefault("logOptions", {})
+			elif opt == "--segment-size":
+				pollOptions.setdefault("logOptions", {})["maxBytes"] = int(arg) * 1024 * 1024
+			elif opt == "--segment-age":
+				pollOptions.setdefault("logOptions", {})["maxAge"] = int(arg)
+			elif opt == "--fsync":
+				pollOptions.setdefault("logOptions", {})["fsync"] = arg
+			elif opt == "--write-behind":
+				pollOptions.setdefault("sinkOptions", {})
+			elif opt == "--flush-count":
+				pollOptions.setdefault("sinkOptions", {})["maxBatch"] = int(arg)
+			elif opt == "--flush-interval":
+				pollOptions.setdefault("sinkOptions", {})["maxDelay"] = float(arg)
+			elif opt == "--max-pending":
+				pollOptions.setdefault("sinkOptions", {})["maxPending"] = int(arg)
+			elif opt == "--ack":
+				pollOptions.setdefault("sinkOptions", {})["ackPolicy"] = arg
+			elif opt == "--visibility-timeout":
+				pollOptions["visibilityTimeout"] = int(arg)
+			elif opt == "--dedupe":
+				pollOptions["dedupeOptions"] = {"size": int(arg)}
+			elif opt == "--metrics-port":
+				pollOptions.setdefault("metricsOptions", {})["port"] = int(arg)
+			elif opt == "--stats-file":
+				pollOptions.setdefault("metricsOptions", {})["statsFile"] = arg
+			elif opt == "--stats-interval":
+				pollOptions.setdefault("metricsOptions", {})["interval"] = int(arg)
+			elif opt == "--backlog-interval":
+				pollOptions.setdefault("metricsOptions", {})["backlogInterval"] = int(arg)
+
 		if sys.argv[1] == '-l':
 			showActiveSubscriptions()
 		elif sys.argv[1] == '-d':
 			removeSubscription()
 		elif sys.argv[1] == '-h':
-			startNewsMessages()
+			startNewsMessages(**pollOptions)
 		elif sys.argv[1] == '-s':
-			startNewsMessages(headlines = False)
+			startNewsMessages(headlines = False, **pollOptions)
 	else:
 		print("Arguments:")
 		print("  -l List active subscriptions")
 		print("  -d Delete all subscriptions")
 		print("  -h Subscribe to news headlines")
 		print("  -s Subscribe to news stories")
+		print("Polling options (with -h or -s):")
+		print("  --batch Receive and delete up to %d messages per SQS call" % sqsQueue.MAX_BATCH_SIZE)
+		print("  --workers <n> Decrypt and process messages with a pool of n workers")
+		print("  --deleters <n> Number of workers deleting processed messages (default 1)")
+		print("  --queue-size <n> Stop receiving while n messages are received but not acknowledged (default %d)" % sqsQueue.PIPELINE_QUEUE_SIZE)
+		print("  --low-water <n> Resume receiving once n messages are left (default half of --queue-size)")
+		print("  --jsonl Append messages to rotating JSONL segments instead of one file per message")
+		print("  --segment-size <mb>, --segment-age <seconds>, --fsync <always|interval|never> Segment rotation and sync policy")
+		print("  --write-behind Write messages from a background thread in batches")
+		print("  --flush-count <n>, --flush-interval <seconds>, --ack <processed|durable> Batch size, delay and acknowledgement policy")
+		print("  --max-pending <n> Stop taking messages while n are waiting to be written (default %d)" % writeBehind.DEFAULT_MAX_PENDING)
+		print("  --visibility-timeout <seconds> Keep extending the visibility timeout of messages while they are processed")
+		print("  --dedupe <size> Skip messages which were already processed, remembering <size> of them in memory")
+		print("  --metrics-port <port> Serve per-stage latency and throughput metrics on http://127.0.0.1:<port>/metrics")
+		print("  --stats-file <file>, --stats-interval <seconds> Write the metrics to a JSON file every interval (default %d)" % pipelineMetrics.DEFAULT_STATS_INTERVAL)
+		print("  --backlog-interval <seconds> Sample the number of waiting messages of the queue, 0 disables it (default %d)" % pipelineMetrics.DEFAULT_BACKLOG_INTERVAL)
@@ -0,0 +1,299 @@
+#=============================================================================
+# Per-stage latency and throughput metrics of the message pipeline
+# The pollers record how long each message spends in every stage (receive wait, decrypt,
+# JSON parse, metadata write, callback and delete) and count messages, bytes and errors
+# per subscription, together with the lag from publish to processed, the backlog of the queue, and
+# how long each stage was blocked by backpressure.
+# The metrics are served as Prometheus text and/or written to a stats file
+#	http://127.0.0.1:<port>/metrics
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import http.server
+import json
+import os
+import threading
+import time
+import traceback
+
+# download: the report downloads of downloadPool, after the callback handed them over
+STAGES = ["receive", "decrypt", "parse", "store", "callback", "download", "delete"]
+# duplicates: messages skipped by the dedupe cache
+COUNTERS = ["messages", "bytes", "errors", "duplicates"]
+# upper bounds of the histogram buckets in seconds
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20]
+# upper bounds of the lag histogram in seconds, from publish to processed
+LAG_BUCKETS = [0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+# SQS queue attribute -> gauge, sampled with get_queue_attributes
+BACKLOG_ATTRIBUTES = {
+	"ApproximateNumberOfMessages": "backlog_messages",
+	"ApproximateNumberOfMessagesNotVisible": "in_flight_messages",
+	"ApproximateNumberOfMessagesDelayed": "delayed_messages"
+}
+# buffered_messages: received but not acknowledged yet, see backpressure.FlowControl
+# pending_downloads: jobs of downloadJobs which are pending or in progress
+GAUGES = ["last_lag_seconds", "buffered_messages", "pending_downloads"] + list(BACKLOG_ATTRIBUTES.values())
+DEFAULT_STATS_INTERVAL = 10
+DEFAULT_BACKLOG_INTERVAL = 30
+
+_registry = {}
+_servers = {}
+_writers = {}
+_registryLock = threading.Lock()
+
+
+#==============================================
+class Histogram:
+#==============================================
+	def __init__(self, bounds=BUCKETS):
+		self.bounds = bounds
+		self.counts = [0] * (len(bounds) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value, count=1):
+		i = 0
+		while i < len(self.bounds) and value > self.bounds[i]:
+			i += 1
+		self.counts[i] += count
+		self.sum += value * count
+		self.count += count
+
+	def snapshot(self):
+		# cumulative counts per upper bound, like Prometheus
+		buckets = []
+		total = 0
+		for bound, count in zip(self.bounds + ["+Inf"], self.counts):
+			total += count
+			buckets.append([bound, total])
+		return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+#==============================================
+class PipelineMetrics:
+#==============================================
+	def __init__(self, subscriptionId):
+		self.subscriptionId = subscriptionId
+		self.lock = threading.Lock()
+		self.histograms = {stage: Histogram() for stage in STAGES}
+		self.counters = {name: 0 for name in COUNTERS}
+		self.lag = Histogram(LAG_BUCKETS)
+		# None until first known
+		self.gauges = {name: None for name in GAUGES}
+		# stage -> seconds spent waiting for a full buffer downstream
+		self.blocked = {}
+
+	def observe(self, stage, seconds, count=1):
+		# count > 1 records the average of a batch for each of its messages
+		with self.lock:
+			self.histograms[stage].observe(seconds, count)
+
+	def count(self, name, value=1):
+		with self.lock:
+			self.counters[name] += value
+
+	def addBlocked(self, stage, seconds):
+		with self.lock:
+			self.blocked[stage] = self.blocked.get(stage, 0.0) + seconds
+
+	def setGauge(self, name, value):
+		with self.lock:
+			self.gauges[name] = value
+
+	def observeLag(self, message, now=None):
+		# seconds since the message was sent to the queue, needs its SentTimestamp attribute
+		lag = lagOf(message, now)
+		if lag is None:
+			return
+		with self.lock:
+			self.lag.observe(lag)
+			self.gauges["last_lag_seconds"] = lag
+
+	def setBacklog(self, attributes):
+		with self.lock:
+			for attribute, name in BACKLOG_ATTRIBUTES.items():
+				if attribute in attributes:
+					self.gauges[name] = int(attributes[attribute])
+
+	def snapshot(self):
+		with self.lock:
+			return {
+				"stages": {stage: histogram.snapshot() for stage, histogram in self.histograms.items()},
+				"counters": dict(self.counters),
+				"lag": self.lag.snapshot(),
+				"gauges": dict(self.gauges),
+				"blocked": dict(self.blocked)
+			}
+
+
+#==============================================
+def lagOf(message, now=None):
+#==============================================
+	sentTimestamp = message.get('Attributes', {}).get('SentTimestamp')
+	if sentTimestamp is None:
+		return None
+	# milliseconds since the epoch, clocks may differ a little
+	return max(0.0, (now or time.time()) - int(sentTimestamp) / 1000.0)
+
+
+#==============================================
+def sampleBacklog(sqs, endpoint, metrics):
+#==============================================
+	resp = sqs.get_queue_attributes(QueueUrl = endpoint, AttributeNames = list(BACKLOG_ATTRIBUTES))
+	metrics.setBacklog(resp.get('Attributes', {}))
+
+
+#==============================================
+class BacklogSampler:
+#==============================================
+	# samples the number of messages waiting in the queue every interval
+	def __init__(self, sqs, endpoint, metrics, interval=DEFAULT_BACKLOG_INTERVAL):
+		self.sqs = sqs
+		self.endpoint = endpoint
+		self.metrics = metrics
+		self.interval = interval
+		self.stopEvent = threading.Event()
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	def _run(self):
+		while 1:
+			try:
+				sampleBacklog(self.sqs, self.endpoint, self.metrics)
+			except Exception as err:
+				print("Unable to sample the queue backlog: %s" % err)
+			if self.stopEvent.wait(self.interval):
+				break
+
+	def close(self):
+		self.stopEvent.set()
+		self.thread.join()
+
+
+#==============================================
+def forSubscription(subscriptionId):
+#==============================================
+	# one instance per subscription, also when its poller restarts
+	with _registryLock:
+		metrics = _registry.get(subscriptionId)
+		if metrics is None:
+			metrics = _registry[subscriptionId] = PipelineMetrics(subscriptionId)
+		return metrics
+
+
+#==============================================
+def snapshotAll():
+#==============================================
+	with _registryLock:
+		registry = list(_registry.values())
+	return {metrics.subscriptionId: metrics.snapshot() for metrics in registry}
+
+
+#==============================================
+def prometheusText():
+#==============================================
+	lines = [
+		"# HELP msg_dist_stage_seconds Time a message spends in each pipeline stage",
+		"# TYPE msg_dist_stage_seconds histogram"
+	]
+	snapshots = snapshotAll()
+	for subscriptionId, snapshot in snapshots.items():
+		for stage, histogram in snapshot["stages"].items():
+			labels = 'subscription="%s",stage="%s"' % (subscriptionId, stage)
+			for bound, count in histogram["buckets"]:
+				lines.append('msg_dist_stage_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+			lines.append("msg_dist_stage_seconds_sum{%s} %f" % (labels, histogram["sum"]))
+			lines.append("msg_dist_stage_seconds_count{%s} %d" % (labels, histogram["count"]))
+	lines.append("# HELP msg_dist_lag_seconds Time from publishing a message to processing it")
+	lines.append("# TYPE msg_dist_lag_seconds histogram")
+	for subscriptionId, snapshot in snapshots.items():
+		labels = 'subscription="%s"' % subscriptionId
+		histogram = snapshot["lag"]
+		for bound, count in histogram["buckets"]:
+			lines.append('msg_dist_lag_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+		lines.append("msg_dist_lag_seconds_sum{%s} %f" % (labels, histogram["sum"]))
+		lines.append("msg_dist_lag_seconds_count{%s} %d" % (labels, histogram["count"]))
+	for name in COUNTERS:
+		lines.append("# TYPE msg_dist_%s_total counter" % name)
+		for subscriptionId, snapshot in snapshots.items():
+			lines.append('msg_dist_%s_total{subscription="%s"} %d' % (name, subscriptionId, snapshot["counters"][name]))
+	lines.append("# HELP msg_dist_blocked_seconds_total Time a stage waited for a full buffer downstream")
+	lines.append("# TYPE msg_dist_blocked_seconds_total counter")
+	for subscriptionId, snapshot in snapshots.items():
+		for stage, seconds in sorted(snapshot["blocked"].items()):
+			lines.append('msg_dist_blocked_seconds_total{subscription="%s",stage="%s"} %f' % (subscriptionId, stage, seconds))
+	for name in GAUGES:
+		lines.append("# TYPE msg_dist_%s gauge" % name)
+		for subscriptionId, snapshot in snapshots.items():
+			value = snapshot["gauges"][name]
+			if value is not None:
+				lines.append('msg_dist_%s{subscription="%s"} %s' % (name, subscriptionId, value))
+	return "\n".join(lines) + "\n"
+
+
+#==============================================
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+#==============================================
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		body = prometheusText().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+#==============================================
+class StatsFileWriter:
+#==============================================
+	# rewrites the stats file with a JSON snapshot of all subscriptions every interval
+	def __init__(self, fileName, interval=DEFAULT_STATS_INTERVAL):
+		self.fileName = fileName
+		self.interval = interval
+		self.stopEvent = threading.Event()
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	def write(self):
+		tmpFile = self.fileName + ".tmp"
+		with open(tmpFile, "w") as f:
+			json.dump({"time": time.time(), "subscriptions": snapshotAll()}, f, indent = 2)
+		# readers never see a partly written file
+		os.replace(tmpFile, self.fileName)
+
+	def _run(self):
+		while not self.stopEvent.wait(self.interval):
+			try:
+				self.write()
+			except Exception as err:
+				traceback.print_exc()
+				print("Unable to write stats file: %s" % err)
+
+
+#==============================================
+def startExporters(metricsOptions=None):
+#==============================================
+	# metricsOptions: port (Prometheus endpoint), statsFile, interval and backlogInterval (used by
+	# the pollers for their BacklogSampler, 0 disables it). Exporters are shared
+	# by all subscriptions of the process and run until it exits
+	if not metricsOptions:
+		return
+	with _registryLock:
+		port = metricsOptions.get("port")
+		if port and port not in _servers:
+			server = http.server.ThreadingHTTPServer((metricsOptions.get("host", "127.0.0.1"), port), MetricsRequestHandler)
+			server.daemon_threads = True
+			threading.Thread(target = server.serve_forever, daemon = True).start()
+			_servers[port] = server
+			print("Serving metrics on http://%s:%d/metrics" % server.server_address)
+		fileName = metricsOptions.get("statsFile")
+		if fileName and fileName not in _writers:
+			_writers[fileName] = StatsFileWriter(fileName, metricsOptions.get("interval", DEFAULT_STATS_INTERVAL))
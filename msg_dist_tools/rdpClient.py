@@ -0,0 +1,414 @@
+#=============================================================================
+# Shared HTTP session and request scheduler for the Refinitiv Data Platform calls
+# All modules send their requests through one requests.Session, so the connections to
+# api.refinitiv.com are kept alive and reused instead of a new TCP and TLS handshake per call.
+# Requests to each RDP endpoint are paced by a token bucket, throttled requests (429) are
+# retried after Retry-After with jitter, and a rejected access token (401) is renewed once.
+# Documents are downloaded in chunks to a temporary file, interrupted transfers are resumed
+# with Range requests, and the file is renamed into place once it is complete. Large documents
+# behind a signed link can be fetched as several byte ranges at once and joined on disk
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import concurrent.futures
+import email.utils
+import glob
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import shutil
+import requests
+from requests.adapters import HTTPAdapter
+
+# number of hosts with a pool, and kept alive connections per host
+POOL_CONNECTIONS = 10
+POOL_SIZE = 32
+
+# requests per second and burst per endpoint, e.g. /data/research/v1, only for RDP_HOST
+RDP_HOST = "api.refinitiv.com"
+DEFAULT_RATE = 20
+DEFAULT_BURST = 20
+# endpoint prefix -> (rate, burst), overrides the default for the endpoints starting with it
+RATE_LIMITS = {}
+# retries of a throttled request, and the longest wait without a Retry-After header
+MAX_RETRIES = 5
+MAX_BACKOFF = 60
+# chunk written at a time, the memory a download needs whatever the document size
+CHUNK_SIZE = 1024 * 1024
+# resumed transfers of one download before giving up
+DOWNLOAD_RETRIES = 3
+PART_SUFFIX = ".part"
+# byte ranges of a document fetched at once by rangedDownload, and the smallest range worth a request
+DEFAULT_PARTS = 4
+MIN_PART_SIZE = 4 * 1024 * 1024
+
+_session = None
+_sessionLock = threading.Lock()
+_buckets = {}
+_bucketsLock = threading.Lock()
+
+
+#==============================================
+def createSession(poolSize=POOL_SIZE):
+#==============================================
+	session = requests.Session()
+	# more concurrent requests than poolSize still work, the extra connections are just not kept
+	adapter = HTTPAdapter(pool_connections = POOL_CONNECTIONS, pool_maxsize = poolSize)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	return session
+
+
+#==============================================
+def configure(poolSize=POOL_SIZE):
+#==============================================
+	# e.g. raise the pool size to the number of workers before starting them
+	global _session
+	with _sessionLock:
+		previous = _session
+		_session = createSession(poolSize)
+	if previous is not None:
+		previous.close()
+
+
+#==============================================
+def getSession():
+#==============================================
+	global _session
+	if _session is None:
+		with _sessionLock:
+			if _session is None:
+				_session = createSession()
+	return _session
+
+
+#==============================================
+class TokenBucket:
+#==============================================
+	def __init__(self, rate, burst):
+		self.rate = float(rate)
+		self.burst = burst
+		self.tokens = float(burst)
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def reserve(self):
+		# takes a token, returns how long the caller must wait before sending
+		with self.lock:
+			now = time.monotonic()
+			if now > self.updated:
+				self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+			self.tokens -= 1
+			# below zero the tokens are reservations, each waits for its turn to be refilled
+			return max(0.0, self.updated - now) + max(0.0, -self.tokens / self.rate)
+
+	def pause(self, seconds):
+		# e.g. after a 429, nothing is sent to the endpoint before the pause is over
+		with self.lock:
+			self.updated = max(self.updated, time.monotonic() + seconds)
+			self.tokens = min(self.tokens, 0.0)
+
+
+#==============================================
+def endpointOf(url):
+#==============================================
+	# the path up to the API version, e.g. /data/historical-pricing/v1
+	parts = urllib.parse.urlsplit(url)
+	if parts.hostname != RDP_HOST:
+		return None
+	segments = []
+	for segment in parts.path.split("/")[1:]:
+		segments.append(segment)
+		if re.match(r"^v\d+$", segment):
+			break
+	return "/" + "/".join(segments)
+
+
+#==============================================
+def bucketFor(url):
+#==============================================
+	endpoint = endpointOf(url)
+	if endpoint is None:
+		# e.g. signed download links, not subject to the RDP limits
+		return None
+	with _bucketsLock:
+		bucket = _buckets.get(endpoint)
+		if bucket is None:
+			rate, burst = DEFAULT_RATE, DEFAULT_BURST
+			prefixes = [prefix for prefix in RATE_LIMITS if endpoint.startswith(prefix)]
+			if prefixes:
+				rate, burst = RATE_LIMITS[max(prefixes, key = len)]
+			bucket = _buckets[endpoint] = TokenBucket(rate, burst)
+		return bucket
+
+
+#==============================================
+def retryDelay(headers, attempt):
+#==============================================
+	# seconds to wait before retrying a throttled request, Retry-After is seconds or a HTTP date
+	retryAfter = headers.get("Retry-After")
+	delay = None
+	if retryAfter:
+		try:
+			delay = float(retryAfter)
+		except ValueError:
+			try:
+				delay = email.utils.parsedate_to_datetime(retryAfter).timestamp() - time.time()
+			except (TypeError, ValueError):
+				delay = None
+	if delay is None:
+		delay = min(MAX_BACKOFF, 2 ** attempt)
+	# spread the retries of concurrent callers
+	delay = max(0.0, delay)
+	return delay + random.uniform(0, delay * 0.25 + 0.1)
+
+
+#==============================================
+def renewAuthorization(headers):
+#==============================================
+	# returns the headers with a new access token, or None if the request had no bearer token
+	authorization = (headers or {}).get("Authorization", "")
+	if not authorization.startswith("Bearer "):
+		return None
+	# imported here, rdpToken itself sends its requests through this module
+	import rdpToken
+	rdpToken.invalidateToken(authorization[len("Bearer "):])
+	headers = dict(headers)
+	headers["Authorization"] = "Bearer " + rdpToken.getToken()
+	return headers
+
+
+#==============================================
+def request(method, url, **kwargs):
+#==============================================
+	bucket = bucketFor(url)
+	attempt = 0
+	renewed = False
+	while 1:
+		if bucket is not None:
+			wait = bucket.reserve()
+			if wait > 0:
+				time.sleep(wait)
+		response = getSession().request(method, url, **kwargs)
+
+		if response.status_code == 429 and attempt < MAX_RETRIES:
+			delay = retryDelay(response.headers, attempt)
+			attempt += 1
+			print("Request to %s throttled, retrying in %.1f seconds" % (url, delay))
+			response.close()
+			if bucket is not None:
+				# the other callers of the endpoint hold back as well
+				bucket.pause(delay)
+			else:
+				time.sleep(delay)
+			continue
+
+		if response.status_code == 401 and not renewed:
+			# e.g. the token was revoked during the run, try once more with a new one
+			renewed = True
+			headers = renewAuthorization(kwargs.get("headers"))
+			if headers is not None:
+				print("Access token rejected, retrying with a new token")
+				response.close()
+				kwargs["headers"] = headers
+				continue
+		return response
+
+
+#==============================================
+def get(url, **kwargs):
+#==============================================
+	return request("GET", url, **kwargs)
+
+
+#==============================================
+def post(url, **kwargs):
+#==============================================
+	return request("POST", url, **kwargs)
+
+
+#==============================================
+def delete(url, **kwargs):
+#==============================================
+	return request("DELETE", url, **kwargs)
+
+
+#==============================================
+def contentLength(status, headers):
+#==============================================
+	# full size of the document, from Content-Range of a partial response or Content-Length
+	if status == 206:
+		total = headers.get("Content-Range", "").rpartition("/")[2]
+		return int(total) if total.isdigit() else None
+	length = headers.get("Content-Length")
+	# a compressed body does not tell the size of the document
+	if length is None or headers.get("Content-Encoding"):
+		return None
+	return int(length)
+
+
+#==============================================
+def download(url, fileName, expectedSize=None, partFile=None, **kwargs):
+#==============================================
+	# streams url to partFile (fileName + PART_SUFFIX) and renames it once complete, returns whether
+	# fileName was saved and the last response, which tells the error otherwise. A part file left by
+	# an interrupted run is resumed, an incomplete or oversized document raises an exception
+	partFile = partFile or fileName + PART_SUFFIX
+	headers = dict(kwargs.pop("headers", None) or {})
+	# byte ranges of a compressed body would not match the document
+	headers.setdefault("Accept-Encoding", "identity")
+	attempt = 0
+	while 1:
+		offset = os.path.getsize(partFile) if os.path.exists(partFile) else 0
+		if offset:
+			headers["Range"] = "bytes=%d-" % offset
+		else:
+			headers.pop("Range", None)
+		response = request("GET", url, headers = headers, stream = True, **kwargs)
+		with response:
+			if response.status_code == 416 and offset:
+				# the part file reaches the end of the document, Content-Range is bytes */<size>
+				total = response.headers.get("Content-Range", "").rpartition("/")[2]
+				size = int(total) if total.isdigit() else expectedSize
+				if size is None or offset != size or (expectedSize is not None and size != expectedSize):
+					# larger than the document, or left by another one, start over
+					os.remove(partFile)
+					continue
+				# complete already, only the rename was missing
+				expectedSize = size
+			elif response.status_code == 206 and response.headers.get("Content-Range", "").startswith("bytes %d-" % offset):
+				size = contentLength(response.status_code, response.headers)
+				mode = "ab"
+			elif response.status_code == 200:
+				# the server sent the whole document again
+				size = contentLength(response.status_code, response.headers)
+				offset = 0
+				mode = "wb"
+			elif response.status_code == 206:
+				# not the range asked for, start over
+				os.remove(partFile)
+				continue
+			else:
+				# read the error message before the connection goes back to the pool
+				response.content
+				return False, response
+
+			if response.status_code != 416:
+				expectedSize = expectedSize or size
+				try:
+					with open(partFile, mode) as f:
+						for chunk in response.iter_content(CHUNK_SIZE):
+							f.write(chunk)
+				except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as err:
+					attempt += 1
+					if attempt > DOWNLOAD_RETRIES:
+						raise
+					print("Download of %s interrupted, resuming: %s" % (fileName, err))
+					continue
+
+		received = os.path.getsize(partFile)
+		if expectedSize is not None and received < expectedSize:
+			attempt += 1
+			if attempt > DOWNLOAD_RETRIES:
+				raise Exception("Download of %s incomplete, %d of %d bytes" % (fileName, received, expectedSize))
+			print("Download of %s incomplete, resuming at %d of %d bytes" % (fileName, received, expectedSize))
+			continue
+		if expectedSize is not None and received > expectedSize:
+			os.remove(partFile)
+			raise Exception("Download of %s is %d bytes, expected %d" % (fileName, received, expectedSize))
+		os.replace(partFile, fileName)
+		return True, response
+
+
+#==============================================
+def fetchRange(url, partFile, start, end, **kwargs):
+#==============================================
+	# streams the bytes start to end (inclusive) of url to partFile, resuming what an earlier try left there
+	headers = dict(kwargs.pop("headers", None) or {})
+	headers["Accept-Encoding"] = "identity"
+	length = end - start + 1
+	attempt = 0
+	while 1:
+		offset = os.path.getsize(partFile) if os.path.exists(partFile) else 0
+		if offset > length:
+			os.remove(partFile)
+			continue
+		if offset == length:
+			return
+		headers["Range"] = "bytes=%d-%d" % (start + offset, end)
+		response = request("GET", url, headers = headers, stream = True, **kwargs)
+		with response:
+			if response.status_code != 206 or not response.headers.get("Content-Range", "").startswith("bytes %d-%d/" % (start + offset, end)):
+				raise Exception("Range %d-%d of the document was not served, code %s" % (start + offset, end, response.status_code))
+			try:
+				with open(partFile, "ab") as f:
+					for chunk in response.iter_content(CHUNK_SIZE):
+						f.write(chunk)
+			except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as err:
+				attempt += 1
+				if attempt > DOWNLOAD_RETRIES:
+					raise
+				print("Range %d-%d interrupted, resuming: %s" % (start, end, err))
+				continue
+		if os.path.getsize(partFile) < length:
+			attempt += 1
+			if attempt > DOWNLOAD_RETRIES:
+				raise Exception("Range %d-%d incomplete, %d of %d bytes" % (start, end, os.path.getsize(partFile), length))
+
+
+#==============================================
+def rangedDownload(url, fileName, parts=DEFAULT_PARTS, expectedSize=None, partFile=None, **kwargs):
+#==============================================
+	# like download, for links straight to the storage, e.g. signed links: a document of at least two
+	# MIN_PART_SIZE ranges is fetched as up to parts ranges at once, each into its own part file which
+	# a later try resumes, and the ranges are joined into partFile before the rename. Smaller documents,
+	# and servers which do not take ranges, are downloaded as one stream
+	partFile = partFile or fileName + PART_SUFFIX
+	headers = dict(kwargs.pop("headers", None) or {})
+	headers["Accept-Encoding"] = "identity"
+	# the size, and whether ranges are served, from the first byte
+	response = request("GET", url, headers = dict(headers, Range = "bytes=0-0"), stream = True, **kwargs)
+	with response:
+		if response.status_code not in (200, 206):
+			# read the error message before the connection goes back to the pool
+			response.content
+			return False, response
+		size = contentLength(response.status_code, response.headers) if response.status_code == 206 else None
+	if size is None or parts < 2 or size < 2 * MIN_PART_SIZE:
+		return download(url, fileName, expectedSize, partFile, headers = headers, **kwargs)
+	if expectedSize is not None and size != expectedSize:
+		raise Exception("Download of %s is %d bytes, expected %d" % (fileName, size, expectedSize))
+
+	count = min(parts, size // MIN_PART_SIZE)
+	step = -(-size // count)
+	# named after their byte range, a file left by another split, e.g. other parts or size, is not resumed
+	ranges = [("%s.%d-%d" % (partFile, i * step, min(size, (i + 1) * step) - 1), i * step, min(size, (i + 1) * step) - 1)
+		for i in range(count)]
+	for stale in set(glob.glob(glob.escape(partFile) + ".*")) - set(rangeFile for rangeFile, start, end in ranges):
+		os.remove(stale)
+	with concurrent.futures.ThreadPoolExecutor(max_workers = count) as executor:
+		jobs = [executor.submit(fetchRange, url, rangeFile, start, end, headers = headers, **kwargs)
+			for rangeFile, start, end in ranges]
+		# raises the first error once all ranges are done, the part files are kept for the next try
+		concurrent.futures.wait(jobs)
+		for job in jobs:
+			job.result()
+
+	with open(partFile, "wb") as f:
+		for rangeFile, start, end in ranges:
+			with open(rangeFile, "rb") as r:
+				shutil.copyfileobj(r, f, CHUNK_SIZE)
+	received = os.path.getsize(partFile)
+	if received != size:
+		os.remove(partFile)
+		raise Exception("Download of %s is %d bytes, expected %d" % (fileName, received, size))
+	os.replace(partFile, fileName)
+	for rangeFile, start, end in ranges:
+		os.remove(rangeFile)
+	return True, response
@@ -8,6 +8,10 @@
 #		a. Use credentials file, if available
 #		b. Use the command line parameters, if available 
 #		c. Use the hardcoded USERNAME, PASSWORD parameters from this module
+#	4. Renew the token from a background thread shortly before it expires. Only one refresh
+#	   request is in flight at a time, other callers wait for it or use the still valid token
+#	5. When the token broker (tokenBroker.py) is running, all of the above is left to the
+#	   broker and the token is requested from it over a Unix domain socket
 #
 # CLIENT_ID see instructions at https://developers.refinitiv.com/en/api-catalog/refinitiv-data-platform/refinitiv-data-platform-apis/quick-start
 # UUID is required for research messages only and will be provided by Refinitiv
@@ -16,7 +20,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests, json, time, getopt, sys, configparser, traceback
+import rdpClient, json, time, getopt, sys, configparser, traceback, os, threading, socket
 
 # User Credentials
 USERNAME  = "---YOUR PROVIDED RDP MACHINE ID---"
@@ -34,12 +38,34 @@ SCOPE = "trapi"
 
 CREDENTIALS_FILE = "credentials.ini"
 TOKEN_FILE = "token.txt"
+# seconds between checks whether another process has replaced the token file
+TOKEN_CHECK_INTERVAL = 5
+# the background refresher renews the token this many seconds before it expires
+BACKGROUND_REFRESH = True
+REFRESH_MARGIN = 60
+# after a failed background refresh the next try waits twice as long, up to this many seconds
+MAX_REFRESH_BACKOFF = 300
+# socket of the local token broker, see tokenBroker.py, None to never use a broker
+BROKER_SOCKET = "token.sock"
+BROKER_TIMEOUT = 5
+
+# in-memory copy of the token file, so a valid token costs only a clock comparison
+_cachedToken = None
+_cachedMtime = None
+_nextFileCheck = 0
+_credentialsLoaded = False
+# only one refresh request is in flight at a time
+_refreshLock = threading.Lock()
+_refresherThread = None
+# mtime of the broker socket when the broker failed, it is not asked again until the socket is recreated
+_brokerFailedMtime = None
 
 
 #==============================================
 def _loadCredentialsFromFile():
 #==============================================
-	global USERNAME, PASSWORD, CLIENT_ID, UUID
+	global USERNAME, PASSWORD, CLIENT_ID, UUID, _credentialsLoaded
+	_credentialsLoaded = True
 	try:
 		config = configparser.ConfigParser()
 		config.read(CREDENTIALS_FILE)
@@ -82,7 +108,7 @@ def _requestNewToken(refreshToken):
 	print("{}, {}, {}".format(str(tData), CLIENT_ID, CLIENT_SECRET))
 
 	# Make a REST call to get latest access token
-	response = requests.post(
+	response = rdpClient.post(
 		TOKEN_ENDPOINT,
 		headers = {
 			"Accept": "application/json"
@@ -108,13 +134,37 @@ def _requestNewToken(refreshToken):
 #==============================================
 def _saveToken(tknObject):
 #==============================================
-	tf = open(TOKEN_FILE, "w+")
+	# other processes must never read a partly written file, write a copy and rename it
+	tmpFile = "{}.{}.tmp".format(TOKEN_FILE, os.getpid())
+	tf = open(tmpFile, "w+")
 	print("Saving the new token")
 	# append the expiry time to token
 	tknObject["expiry_tm"] = time.time() + int(tknObject["expires_in"]) - 10
 	# store it in the file
 	json.dump(tknObject, tf, indent=4)
 	tf.close()
+	os.replace(tmpFile, TOKEN_FILE)
+	_cacheToken(tknObject, _getTokenFileMtime())
+
+
+
+#==============================================
+def _getTokenFileMtime():
+#==============================================
+	try:
+		return os.stat(TOKEN_FILE).st_mtime_ns
+	except OSError:
+		return None
+
+
+
+#==============================================
+def _cacheToken(tknObject, mtime):
+#==============================================
+	global _cachedToken, _cachedMtime, _nextFileCheck
+	_cachedToken = tknObject
+	_cachedMtime = mtime
+	_nextFileCheck = time.time() + TOKEN_CHECK_INTERVAL
 	
 
 
@@ -149,7 +199,7 @@ def changePassword(user, oldPass, clientID, newPass):
 	}
 
 	# make a REST call to get latest access token
-	response = requests.post(
+	response = rdpClient.post(
 		TOKEN_ENDPOINT,
 		headers = {
 			"Accept": "application/json"
@@ -173,37 +223,177 @@ def changePassword(user, oldPass, clientID, newPass):
 
 
 #==============================================
-def getToken():
+def _refreshToken(minValidity):
+#==============================================
+	# callers arriving during a refresh wait here and then find the renewed token
+	with _refreshLock:
+		# the file is read again only when it changed, e.g. another process refreshed the token
+		tknObject = _cachedToken
+		mtime = _getTokenFileMtime()
+		if tknObject is None or mtime != _cachedMtime:
+			tknObject = _loadToken()
+		_cacheToken(tknObject, mtime)
+
+		if tknObject is not None:
+			# is access token valid
+			if tknObject["expiry_tm"] > time.time() + minValidity:
+				# UUID etc. are needed by the callers, the file is read once
+				if not _credentialsLoaded:
+					_loadCredentialsFromFile()
+				# return access token
+				return tknObject["access_token"]
+
+			print("Token expired, refreshing a new one...")
+
+			# get a new token using refresh token
+			tknObject = _requestNewToken(tknObject["refresh_token"])
+			# if refresh grant failed
+			if tknObject is None:
+				print("Refresh token expired, using Password Grant...")
+				# use password grant
+				tknObject = _requestNewToken(None)
+		else:
+			print("Getting a new token using Password Grant...")
+			tknObject = _requestNewToken(None)
+
+		# persist this token for future queries
+		_saveToken(tknObject)
+		# return access token
+		return tknObject["access_token"]
+
+
+
+#==============================================
+def _refreshWorker():
 #==============================================
-	tknObject = _loadToken()
+	failures = 0
+	while 1:
+		tknObject = _cachedToken
+		delay = TOKEN_CHECK_INTERVAL
+		if failures:
+			# the token server is down or rejects the credentials, do not hammer it
+			delay = min(MAX_REFRESH_BACKOFF, TOKEN_CHECK_INTERVAL * 2 ** failures)
+		elif tknObject is not None:
+			delay = max(TOKEN_CHECK_INTERVAL, tknObject["expiry_tm"] - REFRESH_MARGIN - time.time())
+		time.sleep(delay)
+		try:
+			# renew ahead of the expiry, the callers keep using the valid token meanwhile
+			_refreshToken(REFRESH_MARGIN)
+			failures = 0
+		except Exception:
+			traceback.print_exc()
+			failures += 1
 
-	if tknObject is not None:
-		# is access token valid
-		if tknObject["expiry_tm"] > time.time():
-			_loadCredentialsFromFile()
-			# return access token
-			return tknObject["access_token"]
 
-		print("Token expired, refreshing a new one...")
-		
-		# get a new token using refresh token
-		tknObject = _requestNewToken(tknObject["refresh_token"])
-		# if refresh grant failed
-		if tknObject is None:
-			print("Refresh token expired, using Password Grant...")
-			# use password grant
-			tknObject = _requestNewToken(None)
-	else:
-		print("Getting a new token using Password Grant...")
-		tknObject = _requestNewToken(None)
 
-	# persist this token for future queries
-	_saveToken(tknObject)
-	# return access token
+#==============================================
+def _startRefresher():
+#==============================================
+	global _refresherThread
+	with _refreshLock:
+		if _refresherThread is None:
+			_refresherThread = threading.Thread(target = _refreshWorker, daemon = True)
+			_refresherThread.start()
+
+
+
+#==============================================
+def _brokerAvailable():
+#==============================================
+	if BROKER_SOCKET is None or not hasattr(socket, "AF_UNIX"):
+		return False
+	try:
+		mtime = os.stat(BROKER_SOCKET).st_mtime_ns
+	except OSError:
+		return False
+	# e.g. a socket left over from a killed broker, skipped until a broker is started again
+	return mtime != _brokerFailedMtime
+
+
+
+#==============================================
+def _brokerFailed(err):
+#==============================================
+	global _brokerFailedMtime
+	try:
+		_brokerFailedMtime = os.stat(BROKER_SOCKET).st_mtime_ns
+	except OSError:
+		_brokerFailedMtime = None
+	print("Token broker is not available ({}), using the token file".format(err))
+
+
+
+#==============================================
+def _requestBrokerToken(request=b"GET\n"):
+#==============================================
+	# request is GET, or RENEW <revoked token> to have the broker replace the token first
+	global UUID
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.settimeout(BROKER_TIMEOUT)
+		sock.connect(BROKER_SOCKET)
+		sock.sendall(request)
+		response = b""
+		while not response.endswith(b"\n"):
+			data = sock.recv(4096)
+			if not data:
+				break
+			response += data
+
+	tknObject = json.loads(response)
+	if "error" in tknObject:
+		raise Exception("Token broker failed to get access token - {}".format(tknObject["error"]))
+	if tknObject.get("uuid"):
+		UUID = tknObject["uuid"]
+	# held until the next file check interval, then the broker is asked again. The mtime
+	# never matches, so without the broker the token file is read again
+	_cacheToken(tknObject, -1)
 	return tknObject["access_token"]
 
 
 
+#==============================================
+def invalidateToken(accessToken):
+#==============================================
+	# e.g. the token was revoked, the next getToken() requests a new one
+	global _cachedToken
+	with _refreshLock:
+		tknObject = _cachedToken
+		if tknObject is not None and tknObject.get("access_token") == accessToken:
+			_cachedToken = dict(tknObject, expiry_tm = 0)
+	if _brokerAvailable():
+		# the broker would hand out the same token again, and so to all the other processes
+		try:
+			_requestBrokerToken(b"RENEW " + accessToken.encode() + b"\n")
+		except (OSError, ValueError) as err:
+			_brokerFailed(err)
+
+
+
+#==============================================
+def getToken():
+#==============================================
+	tknObject = _cachedToken
+	now = time.time()
+	if tknObject is not None and tknObject["expiry_tm"] > now and now < _nextFileCheck:
+		return tknObject["access_token"]
+
+	if tknObject is not None and tknObject["expiry_tm"] > now and _refreshLock.locked():
+		# a refresh is in flight, the current token is still good
+		return tknObject["access_token"]
+
+	if _brokerAvailable():
+		try:
+			return _requestBrokerToken()
+		except (OSError, ValueError) as err:
+			_brokerFailed(err)
+
+	accessToken = _refreshToken(0)
+	if BACKGROUND_REFRESH and _refresherThread is None:
+		_startRefresher()
+	return accessToken
+
+
+
 #==============================================
 if __name__ == "__main__":	
 #==============================================
@@ -0,0 +1,126 @@
+#=============================================================================
+# Content-addressed store of the research reports
+# Each report is kept once, named by the SHA-256 of its content, and an index maps the
+# DocumentId to it. The files under reports/<subscriptionId> are hard links (or symbolic
+# links where hard links are not possible) to the stored report, so a document received on
+# several subscriptions, or redelivered, is downloaded and stored only once
+#	reports/.store/index.db
+#	reports/.store/blobs/<first 2 hex digits>/<sha256>.<extension>
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+STORE_DIR_NAME = ".store"
+INDEX_FILE_NAME = "index.db"
+HASH_CHUNK_SIZE = 1024 * 1024
+# seconds to wait for another process writing the index
+INDEX_TIMEOUT = 30
+
+_stores = {}
+_storesLock = threading.Lock()
+
+
+#==============================================
+def fileHash(path):
+#==============================================
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+#==============================================
+def linkFile(source, view):
+#==============================================
+	# a hard link shares the file, a relative symbolic link is the fallback, e.g. across devices
+	if os.path.lexists(view):
+		os.remove(view)
+	try:
+		os.link(source, view)
+	except OSError:
+		os.symlink(os.path.relpath(source, os.path.dirname(view) or "."), view)
+
+
+#==============================================
+class ReportStore:
+#==============================================
+	# one index shared by all subscriptions and processes using the reports folder
+	def __init__(self, reportsFolder):
+		self.folder = os.path.join(reportsFolder, STORE_DIR_NAME)
+		os.makedirs(os.path.join(self.folder, "blobs"), exist_ok = True)
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(os.path.join(self.folder, INDEX_FILE_NAME), timeout = INDEX_TIMEOUT, check_same_thread = False)
+		with self.db:
+			self.db.execute("CREATE TABLE IF NOT EXISTS documents (documentId TEXT, fileType TEXT, hash TEXT, size INTEGER, blob TEXT, added REAL, PRIMARY KEY (documentId, fileType))")
+			self.db.execute("CREATE TABLE IF NOT EXISTS views (documentId TEXT, fileType TEXT, subscriptionId TEXT, path TEXT, PRIMARY KEY (documentId, fileType, subscriptionId))")
+
+	def lookup(self, documentId, fileType):
+		# the stored file of the document, or None when it was not downloaded yet
+		with self.lock:
+			row = self.db.execute("SELECT blob FROM documents WHERE documentId = ? AND fileType = ?", (str(documentId), fileType)).fetchone()
+		if row is None:
+			return None
+		blob = os.path.join(self.folder, row[0])
+		if not os.path.exists(blob):
+			# removed by hand, download it again
+			with self.lock, self.db:
+				self.db.execute("DELETE FROM documents WHERE documentId = ? AND fileType = ?", (str(documentId), fileType))
+			return None
+		return blob
+
+	def add(self, documentId, fileType, path):
+		# moves a downloaded file into the store and leaves a link in its place, returns the stored file
+		digest = fileHash(path)
+		extension = os.path.splitext(path)[1]
+		name = os.path.join("blobs", digest[:2], digest + extension)
+		blob = os.path.join(self.folder, name)
+		os.makedirs(os.path.dirname(blob), exist_ok = True)
+		if os.path.exists(blob):
+			# the same content under another DocumentId
+			os.remove(path)
+		else:
+			os.replace(path, blob)
+		linkFile(blob, path)
+		with self.lock, self.db:
+			self.db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+				(str(documentId), fileType, digest, os.path.getsize(blob), name, time.time()))
+		return blob
+
+	def view(self, documentId, fileType, subscriptionId):
+		# the link of the document in a subscription folder, if it is still there
+		with self.lock:
+			row = self.db.execute("SELECT path FROM views WHERE documentId = ? AND fileType = ? AND subscriptionId = ?",
+				(str(documentId), fileType, subscriptionId)).fetchone()
+		if row is not None and os.path.exists(row[0]):
+			return row[0]
+		return None
+
+	def addView(self, documentId, fileType, subscriptionId, path, blob=None):
+		# links the stored file to path unless it is there already, e.g. the file which was just added
+		if blob is not None:
+			linkFile(blob, path)
+		with self.lock, self.db:
+			self.db.execute("INSERT OR REPLACE INTO views VALUES (?, ?, ?, ?)", (str(documentId), fileType, subscriptionId, path))
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+
+#==============================================
+def forFolder(reportsFolder):
+#==============================================
+	# one store per reports folder and process
+	with _storesLock:
+		store = _stores.get(reportsFolder)
+		if store is None:
+			store = _stores[reportsFolder] = ReportStore(reportsFolder)
+		return store
@@ -5,15 +5,21 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 # =============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 import sqsQueue
+import credentialManager
+import metadataLog
+import writeBehind
+import pipelineMetrics
+import downloadPool
+import downloadJobs
+import reportStore
 import atexit
+import functools
 import sys
-import boto3
 import os
-from botocore.exceptions import ClientError
 import traceback
 import time
 import argparse, textwrap
@@ -47,7 +53,7 @@ def subscribeToResearch():
     }
 
     print(requestData)
-    dResp = requests.post(RESOURCE_ENDPOINT, headers=hdrs, data=json.dumps(requestData))
+    dResp = rdpClient.post(RESOURCE_ENDPOINT, headers=hdrs, data=json.dumps(requestData))
     if dResp.status_code != 200:
         raise ValueError("Unable to subscribe. Code %s, Message: %s" % (dResp.status_code, dResp.text))
     else:
@@ -56,7 +62,7 @@ def subscribeToResearch():
 
 
 # ==============================================
-def getCloudCredentials(endpoint):
+def requestCloudCredentials(endpoint):
     # ==============================================
     category_URL = "/auth/cloud-credentials"
     endpoint_URL = "/"
@@ -67,17 +73,24 @@ def getCloudCredentials(endpoint):
 
     # get the latest access token
     accessToken = rdpToken.getToken()
-    dResp = requests.get(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken}, params=requestData)
+    dResp = rdpClient.get(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken}, params=requestData)
     if dResp.status_code != 200:
         raise ValueError("Unable to get credentials. Code %s, Message: %s" % (dResp.status_code, dResp.text))
     else:
         jResp = json.loads(dResp.text)
-        return jResp["credentials"]["accessKeyId"], jResp["credentials"]["secretKey"], jResp["credentials"][
-            "sessionToken"]
+        # accessKeyId, secretKey, sessionToken and expiration
+        return jResp["credentials"]
+
+
+# ==============================================
+def getCloudCredentials(endpoint):
+    # ==============================================
+    jCredentials = requestCloudCredentials(endpoint)
+    return jCredentials["accessKeyId"], jCredentials["secretKey"], jCredentials["sessionToken"]
 
 
 # ==============================================
-def downloadReport(rMessage, subscriptionId, fileTypeValue, isRawResponse):
+def reportTarget(rMessage, subscriptionId, fileTypeValue, isRawResponse):
     # ==============================================
     print('--------- Download research report -----------')
     # print(json.dumps(rMessage, indent=2))
@@ -119,41 +132,79 @@ def downloadReport(rMessage, subscriptionId, fileTypeValue, isRawResponse):
         else:
             filename = "report_{}_{}".format(time_str, filename)
 
-    if fileType == 'pdf' or fileType == 'txt' or fileType == 'htm':
-        print('Downloading the file: %s' % filename)
-        if fileType == 'htm':
-            fileTypeInput = 'txt'
-        category_URL = "/data/research"
-        endpoint_URL = "/documents/"
-        requestData = {
-            "uuid": rdpToken.UUID,
-            "doNotRedirect": isRawResponse
-        }
-        RESOURCE_ENDPOINT = base_URL + category_URL + RDP_version + endpoint_URL + str(docID) + "/" + fileTypeInput
+    if fileType == 'htm':
+        fileTypeInput = 'txt'
 
-        # get the latest access token
-        accessToken = rdpToken.getToken()
-        dResp = requests.get(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken}, params=requestData)
-        if dResp.status_code != 200:
-            print("Error - Unable to get the research report. Code %s, Message: %s" % (dResp.status_code, dResp.text))
+    # only used to check the download, a missing or non-numeric size skips the check
+    try:
+        size = int(pl.get('DocumentFileSize'))
+    except (TypeError, ValueError):
+        size = None
+    if size is not None and size <= 0:
+        size = None
+
+    return {
+        "fileType": fileType,
+        "fileTypeInput": fileTypeInput,
+        "docID": docID,
+        "filename": filename,
+        "folder": folder_name,
+        "time_str": time_str,
+        "isRawResponse": isRawResponse,
+        "size": size
+    }
+
+
+# ==============================================
+def isDownloadable(target):
+    # ==============================================
+    return target["fileType"] == 'pdf' or target["fileType"] == 'txt' or target["fileType"] == 'htm'
+
+
+# ==============================================
+def reportRequest(target):
+    # ==============================================
+    category_URL = "/data/research"
+    endpoint_URL = "/documents/"
+    requestData = {
+        "uuid": rdpToken.UUID,
+        "doNotRedirect": target["isRawResponse"]
+    }
+    RESOURCE_ENDPOINT = base_URL + category_URL + RDP_version + endpoint_URL + str(target["docID"]) + "/" + target["fileTypeInput"]
+    return RESOURCE_ENDPOINT, requestData
+
+
+# ==============================================
+def saveReport(target, content):
+    # ==============================================
+    try:
+        path = target["folder"] + "/" + target["filename"]
+        if not target["isRawResponse"] and os.path.lexists(path):
+            # a link into the report store, replaced rather than written through
+            os.remove(path)
+        if target["isRawResponse"] or target["fileTypeInput"] == 'txt':
+            with open(target["folder"] + "/" + target["filename"], 'w') as f:
+                f.write(json.dumps(str(content), indent=2))
+                f.close()
         else:
-            try:
-                if isRawResponse or fileTypeInput == 'txt':
-                    with open(folder_name + "/" + filename, 'w') as f:
-                        f.write(json.dumps(str(dResp.content), indent=2))
-                        f.close()
-                else:
-                    with open(folder_name + "/" + filename, 'wb') as f:
-                        f.write(dResp.content)
-                        f.close()
-            except Exception as err:
-                print(str(dResp.content))
-                print(err)
+            with open(target["folder"] + "/" + target["filename"], 'wb') as f:
+                f.write(content)
+                f.close()
+    except Exception as err:
+        print(str(content))
+        print(err)
+
 
-    elif fileType == 'URL':
-        print('Saving the link to URL: %s' % filename)
+# ==============================================
+def saveReportNotice(rMessage, target):
+    # ==============================================
+    folder_name = target["folder"]
+    docID = target["docID"]
+    time_str = target["time_str"]
+    if target["fileType"] == 'URL':
+        print('Saving the link to URL: %s' % target["filename"])
         with open(folder_name + "/" + str(docID) + "_" + time_str + "_" + ".link", 'wb') as f:
-            f.write(filename.encode())
+            f.write(target["filename"].encode())
             f.close()
 
     else:
@@ -178,9 +229,109 @@ def downloadReport(rMessage, subscriptionId, fileTypeValue, isRawResponse):
 
 
 # ==============================================
-def startResearchAlerts(downloadReports, subscriptionId=None, isRawResponse=False, fileType='pdf'):
+def linkStoredReport(target, subscriptionId):
+    # ==============================================
+    # True when the report was downloaded before, on any subscription, it is linked instead of downloaded.
+    # Raw responses carry a signed link which expires, they are not kept in the store
+    if target["isRawResponse"]:
+        return False
+    store = reportStore.forFolder(REPORTS_DIR_NAME)
+    blob = store.lookup(target["docID"], target["fileTypeInput"])
+    if blob is None:
+        return False
+    if store.view(target["docID"], target["fileTypeInput"], subscriptionId) is None:
+        path = target["folder"] + "/" + target["filename"]
+        store.addView(target["docID"], target["fileTypeInput"], subscriptionId, path, blob)
+        print('Report %s was downloaded before, linked to %s' % (target["docID"], path))
+    else:
+        print('Report %s was downloaded before' % target["docID"])
+    return True
+
+
+# ==============================================
+def storeReport(target, subscriptionId):
+    # ==============================================
+    # moves a downloaded report into the store, the subscription folder keeps a link to it
+    path = target["folder"] + "/" + target["filename"]
+    if target["isRawResponse"] or not os.path.exists(path):
+        return
+    store = reportStore.forFolder(REPORTS_DIR_NAME)
+    store.add(target["docID"], target["fileTypeInput"], path)
+    store.addView(target["docID"], target["fileTypeInput"], subscriptionId, path)
+
+
+# ==============================================
+def resolveSignedUrl(RESOURCE_ENDPOINT, requestData, headers):
+    # ==============================================
+    # the link to the document in storage, as returned with doNotRedirect
+    dResp = rdpClient.get(RESOURCE_ENDPOINT, headers=headers, params=dict(requestData, doNotRedirect=True))
+    if dResp.status_code != 200:
+        print("Error - Unable to get the research report link. Code %s, Message: %s" % (dResp.status_code, dResp.text))
+        return None
+    signedUrl = json.loads(dResp.text).get("signedUrl")
+    if not signedUrl:
+        print("Error - No signed link in the research report response: %s" % dResp.text)
+    return signedUrl
+
+
+# ==============================================
+def downloadReport(rMessage, subscriptionId, fileTypeValue, isRawResponse, parts=0):
+    # ==============================================
+    # returns False when the report could not be downloaded, e.g. to retry it in downloadJobs.
+    # With parts > 1 a PDF is fetched from its signed link in up to parts byte ranges at once
+    target = reportTarget(rMessage, subscriptionId, fileTypeValue, isRawResponse)
+
+    if isDownloadable(target):
+        # the index is checked before any request
+        if linkStoredReport(target, subscriptionId):
+            return True
+        print('Downloading the file: %s' % target["filename"])
+        RESOURCE_ENDPOINT, requestData = reportRequest(target)
+
+        # get the latest access token
+        accessToken = rdpToken.getToken()
+        headers = {"Authorization": "Bearer " + accessToken}
+        if target["isRawResponse"] or target["fileTypeInput"] == 'txt':
+            # a small JSON or text response, saved by saveReport
+            dResp = rdpClient.get(RESOURCE_ENDPOINT, headers=headers, params=requestData)
+            if dResp.status_code != 200:
+                print("Error - Unable to get the research report. Code %s, Message: %s" % (dResp.status_code, dResp.text))
+                return False
+            saveReport(target, dResp.content)
+            storeReport(target, subscriptionId)
+            return True
+
+        # streamed to disk in chunks and resumed if interrupted, checked against the size of the alert.
+        # The file name has the time of download, the part file is named after the document instead,
+        # so a redelivered message resumes it
+        expectedSize = target["size"] if target["fileType"] == 'pdf' else None
+        partFile = "{}/{}_{}{}".format(target["folder"], target["docID"], target["fileTypeInput"], rdpClient.PART_SUFFIX)
+        if parts > 1 and target["fileTypeInput"] == 'pdf':
+            # straight from the storage, the signed link needs no access token
+            signedUrl = resolveSignedUrl(RESOURCE_ENDPOINT, requestData, headers)
+            if signedUrl is None:
+                return False
+            saved, dResp = rdpClient.rangedDownload(signedUrl, target["folder"] + "/" + target["filename"], parts, expectedSize, partFile)
+        else:
+            saved, dResp = rdpClient.download(RESOURCE_ENDPOINT, target["folder"] + "/" + target["filename"], expectedSize,
+                                       partFile, headers=headers, params=requestData)
+        if not saved:
+            print("Error - Unable to get the research report. Code %s, Message: %s" % (dResp.status_code, dResp.text))
+            return False
+        storeReport(target, subscriptionId)
+
+    else:
+        saveReportNotice(rMessage, target)
+    return True
+
+
+# ==============================================
+def startResearchAlerts(downloadReports, subscriptionId=None, isRawResponse=False, fileType='pdf', downloadWorkers=0, durableDownloads=False,
+                        downloadAttempts=downloadJobs.DEFAULT_MAX_ATTEMPTS, downloadParts=0, **pollOptions):
     # ==============================================
     global currentSubscriptionID
+    # only needed for polling, listing and deleting subscriptions start without botocore
+    from botocore.exceptions import ClientError
     try:
         print("Subscribing to research stream ...")
         if subscriptionId is None:
@@ -193,10 +344,36 @@ def startResearchAlerts(downloadReports, subscriptionId=None, isRawResponse=Fals
         print("  Queue endpoint: %s" % (endpoint))
         print("  Subscription ID: %s" % (currentSubscriptionID))
 
+        # keep a connection alive per worker downloading reports
+        if max(pollOptions.get("workers", 0), downloadWorkers) > rdpClient.POOL_SIZE:
+            rdpClient.configure(max(pollOptions.get("workers", 0), downloadWorkers))
+
+        # with download workers the poller hands the downloads over and goes on receiving,
+        # a message is deleted from the queue once its report is downloaded
+        download = downloadReport
+        if downloadParts > 1:
+            download = functools.partial(downloadReport, parts=downloadParts)
+        if downloadReports and durableDownloads:
+            # the message is deleted once its job is recorded, failed downloads are retried and
+            # unfinished ones resumed after a restart
+            jobs = downloadJobs.DownloadJobs(
+                os.path.join(sqsQueue.createDestinationFolder(currentSubscriptionID), downloadJobs.JOBS_FILE_NAME), download,
+                downloadWorkers or downloadJobs.DEFAULT_WORKERS, downloadAttempts, pipelineMetrics.forSubscription(currentSubscriptionID))
+            atexit.register(jobs.close)
+            download = jobs.enqueue
+        elif downloadReports and downloadWorkers > 0:
+            pool = downloadPool.DownloadPool(downloadWorkers, metrics = pipelineMetrics.forSubscription(currentSubscriptionID))
+            atexit.register(pool.close)
+            download = pool.wrap(download)
+
+        # renewed in the background ahead of the expiry, the poller keeps running across rotations
+        print("Getting credentials to connect to AWS Queue...")
+        credentials = credentialManager.CredentialManager(lambda: requestCloudCredentials(endpoint))
+        credentials.start()
+        pollOptions["credentials"] = credentials
         while 1:
             try:
-                print("Getting credentials to connect to AWS Queue...")
-                accessID, secretKey, sessionToken = getCloudCredentials(endpoint)
+                accessID, secretKey, sessionToken = credentials.current()
                 print("Queue access ID: %s" % (accessID))
                 print("Getting research, press BREAK to exit...")
                 if downloadReports:
@@ -206,13 +383,14 @@ def startResearchAlerts(downloadReports, subscriptionId=None, isRawResponse=Fals
                     except:
                         pass
                     sqsQueue.startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey,
-                                          currentSubscriptionID, isRawResponse, downloadReport, fileType)
+                                          currentSubscriptionID, isRawResponse, download, fileType, **pollOptions)
                 else:
                     sqsQueue.startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey,
-                                          currentSubscriptionID, isRawResponse)
+                                          currentSubscriptionID, isRawResponse, **pollOptions)
 
             except ClientError as e:
                 print("Cloud credentials exprired!")
+                credentials.refresh()
     except KeyboardInterrupt:
         print("User requested break, cleaning up...")
         sys.exit(0)
@@ -232,11 +410,11 @@ def removeSubscription(subscription_id=None):
 
     if currentSubscriptionID:
         print("Deleting the open research subscription")
-        dResp = requests.delete(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken},
+        dResp = rdpClient.delete(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken},
                                 params={"subscriptionID": subscription_id, "userID": rdpToken.UUID})
     else:
         print("Deleting ALL open research subscriptions")
-        dResp = requests.delete(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken},
+        dResp = rdpClient.delete(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken},
                                 params={"userID": rdpToken.UUID})
 
     if dResp.status_code > 299:
@@ -260,7 +438,7 @@ def showActiveSubscriptions(subscription_id=None):
     RESOURCE_ENDPOINT = base_URL + category_URL + RDP_version + endpoint_URL
 
     print("Getting all open research subscriptions {0}".format(RESOURCE_ENDPOINT))
-    dResp = requests.get(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken})
+    dResp = rdpClient.get(RESOURCE_ENDPOINT, headers={"Authorization": "Bearer " + accessToken})
 
     if dResp.status_code != 200:
         print("uuid = " + str(rdpToken.UUID))
@@ -316,6 +494,26 @@ if __name__ == "__main__":
 			- python researchMessages.py -p -r -s <subscription id> -t <pdf/txt>
 	   4.4) Download research report as signed url link
 	        - python researchMessages.py -p -r -s <subscription id> -l
+	   4.5) Receive and delete messages in batches of up to 10 (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -b -s <subscription id>
+	   4.6) Process messages with a pool of workers (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> -w <number of workers>
+	   4.7) Store messages in rotating JSONL segments instead of one file per message (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -j -s <subscription id> --segment-size 64 --segment-age 3600 --fsync interval
+	   4.8) Write messages behind the polling thread in batches (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -j -s <subscription id> --write-behind --flush-count 100 --flush-interval 1 --ack durable
+	   4.9) Keep extending the visibility timeout of messages while they are processed (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> -w 4 --visibility-timeout 60
+	   4.10) Skip redelivered messages and reports which were already processed (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> --dedupe 10000
+	   4.11) Serve per-stage latency metrics to Prometheus and write them to a stats file (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> --metrics-port 9108 --stats-file stats.json
+	   4.12) Download reports with a pool of workers while polling goes on (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> --download-workers 8
+	   4.13) Record the downloads in a durable job queue, retry them and resume them after a restart (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> --durable-downloads --download-attempts 5
+	   4.14) Download large PDF reports from their signed link in several byte ranges at once (can be combined with 3.x and 4.x)
+	        - python researchMessages.py -p -r -s <subscription id> --parts 4
 	
 	5) Delete all subscriptions
 	   5.1) Delete all subscriptions
@@ -349,6 +547,80 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--type",
                         help="specify research report file type (Research service support pdf/txt and default value is pdf")
 
+    parser.add_argument("-b", "--batch", action='store_true',
+                        help="receive and delete up to {} messages per SQS call".format(sqsQueue.MAX_BATCH_SIZE))
+
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="decrypt and process messages (and download reports) with a pool of workers, 0 processes them on the polling thread")
+
+    parser.add_argument("--download-workers", type=int, default=0,
+                        help="download reports with a pool of this many workers, a message is deleted once its report is downloaded (used with -r)")
+
+    parser.add_argument("--durable-downloads", action='store_true',
+                        help="record each report download in metadata/<subscriptionId>/{} and delete the message right away, failed downloads are retried with backoff (used with -r)".format(downloadJobs.JOBS_FILE_NAME))
+
+    parser.add_argument("--download-attempts", type=int, default=downloadJobs.DEFAULT_MAX_ATTEMPTS,
+                        help="give up a report after this many failed downloads (used with --durable-downloads)")
+
+    parser.add_argument("--parts", type=int, default=0,
+                        help="download PDF reports of at least {} MB from their signed link in up to this many byte ranges at once (used with -r)".format(
+                            2 * rdpClient.MIN_PART_SIZE // (1024 * 1024)))
+
+    parser.add_argument("--deleters", type=int, default=1,
+                        help="number of workers deleting processed messages from the queue (used with -w)")
+
+    parser.add_argument("--queue-size", type=int, default=sqsQueue.PIPELINE_QUEUE_SIZE,
+                        help="high-water mark: stop receiving while this many messages are received but not acknowledged (used with -w)")
+
+    parser.add_argument("--low-water", type=int, default=None,
+                        help="resume receiving once this many messages are left, default half of --queue-size (used with -w)")
+
+    parser.add_argument("-j", "--jsonl", action='store_true',
+                        help="append messages to rotating JSONL segments with an index instead of one file per message")
+
+    parser.add_argument("--segment-size", type=int, default=metadataLog.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="rotate the JSONL segment after this many MB (used with -j)")
+
+    parser.add_argument("--segment-age", type=int, default=metadataLog.DEFAULT_MAX_AGE,
+                        help="rotate the JSONL segment after this many seconds (used with -j)")
+
+    parser.add_argument("--fsync", default=metadataLog.FSYNC_INTERVAL,
+                        choices=[metadataLog.FSYNC_ALWAYS, metadataLog.FSYNC_INTERVAL, metadataLog.FSYNC_NEVER],
+                        help="when JSONL segments are synced to disk (used with -j)")
+
+    parser.add_argument("--write-behind", action='store_true',
+                        help="write messages from a background thread in batches instead of on the polling thread")
+
+    parser.add_argument("--flush-count", type=int, default=writeBehind.DEFAULT_MAX_BATCH,
+                        help="write the pending messages once this many are waiting (used with --write-behind)")
+
+    parser.add_argument("--flush-interval", type=float, default=writeBehind.DEFAULT_MAX_DELAY,
+                        help="write the pending messages once the oldest has waited this many seconds (used with --write-behind)")
+
+    parser.add_argument("--max-pending", type=int, default=writeBehind.DEFAULT_MAX_PENDING,
+                        help="stop taking messages while this many are waiting to be written (used with --write-behind)")
+
+    parser.add_argument("--ack", default=writeBehind.ACK_PROCESSED, choices=[writeBehind.ACK_PROCESSED, writeBehind.ACK_DURABLE],
+                        help="delete messages from the queue once processed, or only once written (used with --write-behind)")
+
+    parser.add_argument("--visibility-timeout", type=int, default=None,
+                        help="receive messages with this visibility timeout in seconds and keep extending it while they are processed")
+
+    parser.add_argument("--dedupe", type=int, default=None, metavar="SIZE",
+                        help="skip messages and documents which were already processed, remembering SIZE of them in memory")
+
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve per-stage latency and throughput metrics on http://127.0.0.1:PORT/metrics")
+
+    parser.add_argument("--stats-file", default=None,
+                        help="write the per-stage latency and throughput metrics to this JSON file")
+
+    parser.add_argument("--stats-interval", type=int, default=pipelineMetrics.DEFAULT_STATS_INTERVAL,
+                        help="rewrite the stats file every this many seconds (used with --stats-file)")
+
+    parser.add_argument("--backlog-interval", type=int, default=pipelineMetrics.DEFAULT_BACKLOG_INTERVAL,
+                        help="sample the number of waiting messages of the queue every this many seconds, 0 disables it (used with --metrics-port or --stats-file)")
+
     # Read arguments from command line
     args = parser.parse_args()
 
@@ -366,6 +638,40 @@ if __name__ == "__main__":
         else:
             removeSubscription()
     elif args.create or args.poll:
+        poll_options = {
+            "batchSize": sqsQueue.MAX_BATCH_SIZE if args.batch else 1,
+            "workers": args.workers,
+            "downloadWorkers": args.download_workers,
+            "durableDownloads": args.durable_downloads,
+            "downloadAttempts": args.download_attempts,
+            "downloadParts": args.parts,
+            "deleters": args.deleters,
+            "queueSize": args.queue_size,
+            "lowWater": args.low_water,
+            "visibilityTimeout": args.visibility_timeout
+        }
+        if args.jsonl:
+            poll_options["logOptions"] = {
+                "maxBytes": args.segment_size * 1024 * 1024,
+                "maxAge": args.segment_age,
+                "fsync": args.fsync
+            }
+        if args.dedupe:
+            poll_options["dedupeOptions"] = {"size": args.dedupe}
+        if args.metrics_port or args.stats_file:
+            poll_options["metricsOptions"] = {
+                "port": args.metrics_port,
+                "statsFile": args.stats_file,
+                "interval": args.stats_interval,
+                "backlogInterval": args.backlog_interval
+            }
+        if args.write_behind:
+            poll_options["sinkOptions"] = {
+                "maxBatch": args.flush_count,
+                "maxDelay": args.flush_interval,
+                "maxPending": args.max_pending,
+                "ackPolicy": args.ack
+            }
         if args.poll and args.subscriptionId is None:
             raise Exception("subscriptionId is missing please check via 'python researchMessages.py -h'")
         if args.report or args.type or args.link or args.link:
@@ -379,9 +685,9 @@ if __name__ == "__main__":
                 else:
                     file_type = args.type
             startResearchAlerts(download_report, subscriptionId=args.subscriptionId, isRawResponse=is_raw_response,
-                                fileType=str(file_type).lower())
+                                fileType=str(file_type).lower(), **poll_options)
         else:
-            startResearchAlerts(False, subscriptionId=args.subscriptionId)
+            startResearchAlerts(False, subscriptionId=args.subscriptionId, **poll_options)
     else:
         raise Exception("Found invalid command please check via 'python researchMessages.py -h'")
 
@@ -5,7 +5,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 
@@ -74,7 +74,7 @@ if __name__ == "__main__":
 	}
 	"""
 
-	sResp = requests.post(RESOURCE_ENDPOINT, headers=hdrs, data = payload)
+	sResp = rdpClient.post(RESOURCE_ENDPOINT, headers=hdrs, data = payload)
 	if sResp.status_code != 200:
 		raise ValueError("Unable to self register. Code %s, Message: %s" % (sResp.status_code, sResp.text))
 	else:
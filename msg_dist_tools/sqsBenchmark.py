@@ -0,0 +1,249 @@
+#=============================================================================
+# Offline throughput benchmark of the SQS polling modes
+# Polls a local in-process stand-in of the queue, filled with AES-GCM encrypted research
+# alerts, news headlines and news stories in the wire format of sqsQueue.decrypt, through
+# sqsQueue.startPolling (serial, batch and worker pipeline) and asyncMessages.startPolling.
+# Reports messages per second, the p50/p99 latency from receive to delete, and the peak memory
+#	python sqsBenchmark.py [number of messages]
+# Each mode runs in its own process, so the peak memory of one run does not carry over
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import asyncio
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import decryptBenchmark
+import sqsQueue
+
+# name, poller and its options
+MODES = [
+	("serial", "sync", {"batchSize": 1}),
+	("serial --batch", "sync", {"batchSize": sqsQueue.MAX_BATCH_SIZE}),
+	("pipeline -w 4", "sync", {"batchSize": sqsQueue.MAX_BATCH_SIZE, "workers": 4}),
+	("asyncio", "async", {"batchSize": sqsQueue.MAX_BATCH_SIZE, "concurrency": 50})
+]
+PAYLOADS = ["research", "headlines", "stories"]
+SUBSCRIPTION_ID = "benchmark"
+ENDPOINT = "https://sqs.local/benchmark"
+STORY_PARAGRAPHS = 12
+
+
+#==============================================
+def researchPayload(i):
+#==============================================
+	# a research alert as published for the research subscriptions, about 1.5 KB
+	return {
+		"payload": {
+			"DocumentId": "NBTR%09d" % i,
+			"DocumentFileName": "NBTR%09d.pdf" % i,
+			"DocumentFileType": "pdf",
+			"DocumentFileSize": 250000 + i % 1000,
+			"DocumentPageCount": 12,
+			"DocumentReleaseDate": "2021-06-01T08:30:00Z",
+			"Headline": {"DocumentHeadlineValue": "Company %d: Raising estimates after a strong quarter" % i},
+			"Synopsis": {"DocumentSynopsisValue": "We raise our target price as margins expand. " * 6},
+			"Contributor": {"ContributorName": "Example Securities", "ContributorId": 1234},
+			"Analysts": [{"Name": "Analyst %d" % n, "Role": "Primary" if n == 0 else "Secondary"} for n in range(3)],
+			"Companies": [{"Ticker": "CO%d" % i, "RIC": "CO%d.N" % i, "Country": "US"}],
+			"Subjects": ["Earnings", "Equities", "Estimates"],
+			"Entitlements": ["RES/EXAMPLE"]
+		},
+		"sourceSeqNo": i,
+		"sourceTimestamp": "2021-06-01T08:30:00.000Z"
+	}
+
+
+#==============================================
+def newsPayload(i, story):
+#==============================================
+	# a news alert, headlines are about 1 KB and stories carry the body of the article
+	newsItem = {
+		"_version": 1,
+		"itemMeta": {"itemClass": [{"_qcode": "icls:news"}], "firstCreated": {"$": "2021-06-01T08:30:00.000Z"},
+			"versionCreated": {"$": "2021-06-01T08:30:00.000Z"}, "provider": [{"_literal": "NS:RTRS"}]},
+		"contentMeta": {
+			"headline": [{"$": "Company %d shares rise after earnings beat" % i, "_xml:lang": "en"}],
+			"subject": [{"_qcode": "R:CO%d.N" % i}, {"_qcode": "N2:US"}, {"_qcode": "N2:RES"}],
+			"urgency": {"$": 3},
+			"language": [{"_tag": "en"}]
+		}
+	}
+	if story:
+		newsItem["contentSet"] = {"inlineData": [{"$": "Company %d reported quarterly results above estimates. " % i * 20 + "\n" * 2,
+			"_mimetype": "text/plain"} for n in range(STORY_PARAGRAPHS)]}
+	return {"payload": {"newsItem": newsItem}, "sourceSeqNo": i, "sourceTimestamp": "2021-06-01T08:30:00.000Z"}
+
+
+#==============================================
+def generateMessages(payload, count, key):
+#==============================================
+	messages = []
+	for i in range(count):
+		if payload == "research":
+			rMessage = researchPayload(i)
+		else:
+			rMessage = newsPayload(i, payload == "stories")
+		messages.append({
+			"MessageId": "message-%d" % i,
+			"ReceiptHandle": "handle-%d" % i,
+			"Body": decryptBenchmark.encrypt(key, json.dumps(rMessage).encode()),
+			"Attributes": {"ApproximateReceiveCount": "1", "SentTimestamp": str(int(time.time() * 1000))}
+		})
+	return messages
+
+
+#==============================================
+class QueueDrained(Exception):
+#==============================================
+	# ends the poller once every message was received
+	pass
+
+
+#==============================================
+class LocalQueue:
+#==============================================
+	# the calls of the boto3 SQS client used by sqsQueue, answered from memory, recording
+	# when each message was received and deleted
+	def __init__(self, messages):
+		self.messages = list(messages)
+		self.receivedAt = {}
+		self.deletedAt = {}
+		self.lock = threading.Lock()
+
+	def receive_message(self, QueueUrl, WaitTimeSeconds=0, MaxNumberOfMessages=1, **kwargs):
+		with self.lock:
+			if not self.messages:
+				raise QueueDrained()
+			messages = self.messages[:MaxNumberOfMessages]
+			del self.messages[:MaxNumberOfMessages]
+			now = time.perf_counter()
+			for message in messages:
+				self.receivedAt[message["ReceiptHandle"]] = now
+		return {"Messages": messages}
+
+	def delete_message(self, QueueUrl, ReceiptHandle):
+		with self.lock:
+			self.deletedAt[ReceiptHandle] = time.perf_counter()
+		return {}
+
+	def delete_message_batch(self, QueueUrl, Entries):
+		with self.lock:
+			now = time.perf_counter()
+			for entry in Entries:
+				self.deletedAt[entry["ReceiptHandle"]] = now
+		return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+	def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+		return {}
+
+	def change_message_visibility_batch(self, QueueUrl, Entries):
+		return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+
+#==============================================
+class AsyncLocalQueue:
+#==============================================
+	# the same queue for asyncMessages, which expects an aiobotocore client context
+	def __init__(self, queue):
+		self.queue = queue
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		return False
+
+	async def receive_message(self, **kwargs):
+		return self.queue.receive_message(**kwargs)
+
+	async def delete_message(self, **kwargs):
+		return self.queue.delete_message(**kwargs)
+
+	async def delete_message_batch(self, **kwargs):
+		return self.queue.delete_message_batch(**kwargs)
+
+	async def change_message_visibility_batch(self, **kwargs):
+		return self.queue.change_message_visibility_batch(**kwargs)
+
+
+#==============================================
+def percentile(values, p):
+#==============================================
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+#==============================================
+def runMode(mode, payload, count):
+#==============================================
+	# runs one mode in this process, returns its results
+	name, poller, options = MODES[mode]
+	key = os.urandom(32)
+	b64Key = base64.b64encode(key).decode()
+	queue = LocalQueue(generateMessages(payload, count, key))
+
+	# the messages are printed and stored like in production, into a scratch folder
+	stdout = sys.stdout
+	with tempfile.TemporaryDirectory() as folder, open(os.devnull, "w") as devnull:
+		os.chdir(folder)
+		sys.stdout = devnull
+		start = time.perf_counter()
+		try:
+			if poller == "async":
+				import asyncMessages
+				asyncio.run(asyncMessages.startPolling(None, None, None, ENDPOINT, b64Key, SUBSCRIPTION_ID, False,
+					client = AsyncLocalQueue(queue), **options))
+			else:
+				sqsQueue.startPolling(None, None, None, ENDPOINT, b64Key, SUBSCRIPTION_ID, False, client = queue, **options)
+		except QueueDrained:
+			pass
+		finally:
+			sys.stdout = stdout
+			os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+	if len(queue.deletedAt) != count:
+		raise Exception("%s deleted %d of %d messages" % (name, len(queue.deletedAt), count))
+	elapsed = max(queue.deletedAt.values()) - start
+	latencies = [queue.deletedAt[handle] - received for handle, received in queue.receivedAt.items()]
+	return {
+		"rate": count / elapsed,
+		"p50": percentile(latencies, 50) * 1000,
+		"p99": percentile(latencies, 99) * 1000,
+		# kilobytes on Linux, bytes on macOS
+		"maxRss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024 if sys.platform == "darwin" else 1024)
+	}
+
+
+#==============================================
+def runBenchmark(payload, count):
+#==============================================
+	for mode, (name, poller, options) in enumerate(MODES):
+		result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", str(mode), payload, str(count)],
+			stdout = subprocess.PIPE, universal_newlines = True, check = True)
+		r = json.loads(result.stdout.splitlines()[-1])
+		print("%-10s %-16s %9.0f msg/s  p50 %8.2f ms  p99 %8.2f ms  peak %6.1f MB" % (
+			payload, name, r["rate"], r["p50"], r["p99"], r["maxRss"]))
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	if len(sys.argv) > 1 and sys.argv[1] == "--run":
+		# a single mode, started by runBenchmark
+		print(json.dumps(runMode(int(sys.argv[2]), sys.argv[3], int(sys.argv[4]))))
+		sys.exit(0)
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	print("Polling %d messages from a local queue, latency from receive to delete" % count)
+	for payload in PAYLOADS:
+		runBenchmark(payload, count)
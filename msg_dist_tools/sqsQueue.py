@@ -2,29 +2,57 @@
 # Module for polling and extracting news or research alerts from an AWS SQS Queue
 # This module uses boto3 library from Anazon for fetching messages
 # It uses pycryptodome - for AES GCM decryption
+# Both are imported on first use, the tools which do not poll never load them
 #-----------------------------------------------------------------------------
 #   This source code is provided under the Apache 2.0 license
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 #=============================================================================
 
-import boto3
 import json
 import base64
-from Crypto.Cipher import AES
+import concurrent.futures
 import traceback
 import os
 import time
+import queue
+import threading
+import metadataLog
+import writeBehind
+import visibilityHeartbeat
+import dedupeCache
+import credentialManager
+import backpressure
+import pipelineMetrics
 
 REGION = 'us-east-1'
 METADATA_DIR_NAME = 'metadata'
+WAIT_TIME_SECONDS = 10
+# SQS allows up to 10 messages per receive_message/delete_message_batch call
+MAX_BATCH_SIZE = 10
+# message layout: 16 bytes AAD (ending with the 12 bytes nonce) + encrypted message + 16 bytes tag
+GCM_AAD_LENGTH = 16
+GCM_TAG_LENGTH = 16
+GCM_NONCE_LENGTH = 12
+# default size of the bounded queues between the pipeline stages
+PIPELINE_QUEUE_SIZE = 100
+# receive wait while jobs of the callback are running, so their messages are acknowledged soon after
+JOB_WAIT_TIME_SECONDS = 1
+# how long the delete stage waits to fill up a batch
+DELETE_LINGER_SECONDS = 0.2
+# with heartbeats, a message which failed processing is retried through the queue
+# until it was received this many times, then it is deleted like before
+MAX_RECEIVE_COUNT = 5
+# message attributes requested with every receive, for the lag and the retry count
+RECEIVE_ATTRIBUTES = ['SentTimestamp', 'ApproximateReceiveCount']
+
+statsLock = threading.Lock()
 
 #==============================================
 def decrypt(key, source):
 #==============================================
-	GCM_AAD_LENGTH = 16
-	GCM_TAG_LENGTH = 16
-	GCM_NONCE_LENGTH = 12
+	# imported on first use, so the tools which never poll start quickly
+	from Crypto.Cipher import AES
 	key = base64.b64decode(key)
 	cipherText = base64.b64decode(source)
 	
@@ -39,43 +67,108 @@ def decrypt(key, source):
 	return decMessage
 
 
+#==============================================
+class Decryptor:
+#==============================================
+	# decrypts the messages of one subscription, the key is decoded only once
+	def __init__(self, key):
+		from Crypto.Cipher import AES
+		self.AES = AES
+		self.key = base64.b64decode(key)
+
+	def decrypt(self, source):
+		cipherText = base64.b64decode(source)
+		# plain slices on purpose, pycryptodome copies read-only memoryviews before use
+		# and that measured slower than slicing the bytes (see decryptBenchmark.py)
+		cipher = self.AES.new(self.key, self.AES.MODE_GCM, nonce = cipherText[GCM_AAD_LENGTH - GCM_NONCE_LENGTH:GCM_AAD_LENGTH])
+		cipher.update(cipherText[:GCM_AAD_LENGTH])
+		return cipher.decrypt_and_verify(cipherText[GCM_AAD_LENGTH:-GCM_TAG_LENGTH], cipherText[-GCM_TAG_LENGTH:])
+
+	def decrypt_many(self, sources):
+		return [self.decrypt(source) for source in sources]
+
+
 # ==============================================
-def processPayload(payloadText, subscriptionId, fileType, destinationFolder, isRawResponse, callback):
+def storePayload(payloadText, subscriptionId, destinationFolder, store=None, messageId=None):
+    # ==============================================
+    return storeMessage(json.loads(payloadText), subscriptionId, destinationFolder, store, messageId)
+
+
+# ==============================================
+def storeMessage(rMessage, subscriptionId, destinationFolder, store=None, messageId=None):
+    # ==============================================
+    print('--------- Received message -----------')
+    rMessage['payload']
+    if store is not None:
+        # a JSONL segment log or a write-behind sink, see createStore
+        store.append(rMessage, messageId)
+        return rMessage
+
+    time_str = time.strftime("%Y%m%d-%H%M%S")
+    with open("{}/{}_{}_{}".format(destinationFolder, subscriptionId, time_str, "metadata.json"), 'w') as f:
+        f.write(json.dumps(rMessage, indent=2))
+        f.close()
+    return rMessage
+
+
+#==============================================
+def jobSucceeded(job):
+#==============================================
+	# a finished job failed when it raised or returned False, e.g. downloadReport
+	return job.exception() is None and job.result() is not False
+
+
+# ==============================================
+def processPayload(payloadText, subscriptionId, fileType, destinationFolder, isRawResponse, callback, store=None, messageId=None, dedupe=None, stats=None, metrics=None):
     # ==============================================
     try:
+        start = time.perf_counter()
         rMessage = json.loads(payloadText)
-        print('--------- Received message -----------')
-        rMessage['payload']
-        time_str = time.strftime("%Y%m%d-%H%M%S")
-        with open("{}/{}_{}_{}".format(destinationFolder, subscriptionId, time_str, "metadata.json"), 'w') as f:
-            f.write(json.dumps(rMessage, indent=2))
-            f.close()
+        documentId = dedupeCache.documentIdOf(rMessage)
+        if isDuplicate(dedupe, stats, documentId = documentId, metrics = metrics):
+            return True
+        parsed = time.perf_counter()
+        storeMessage(rMessage, subscriptionId, destinationFolder, store, messageId)
+        stored = time.perf_counter()
 
         # handover the decoded message to calling module
+        job = None
         if callback is not None:
-            callback(rMessage, subscriptionId, fileType, isRawResponse)
+            job = callback(rMessage, subscriptionId, fileType, isRawResponse)
         else:
             print(json.dumps(rMessage))  # print(json.dumps(rMessage, indent=2))
 
+        if metrics is not None:
+            metrics.observe('parse', parsed - start)
+            metrics.observe('store', stored - parsed)
+            metrics.observe('callback', time.perf_counter() - stored)
+
         print("\n")
+        if isinstance(job, concurrent.futures.Future):
+            # e.g. a report download of downloadPool, the message is processed once the job has finished
+            if dedupe is not None:
+                job.add_done_callback(lambda job: jobSucceeded(job) and dedupe.add(messageId, documentId))
+            return job
+
+        if job is False:
+            # e.g. the report download failed, the message is processed again
+            return False
+
+        # only remembered once processed, so a failed message is processed again
+        if dedupe is not None:
+            dedupe.add(messageId, documentId)
+        return True
 
     except Exception as err:
         traceback.print_exc()
         print(str(payloadText))
         print(err)
+        return False
 
 
 #==============================================
-def startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey, subscriptionId, isRawResponse, callback=None, fileType=None):
+def createDestinationFolder(subscriptionId):
 #==============================================
-	# create a SQS session
-	session = boto3.Session(
-		aws_access_key_id = accessID,
-		aws_secret_access_key = secretKey,
-		aws_session_token = sessionToken,
-		region_name = REGION
-	)
-
 	destinationFolder = "{}/{}".format(METADATA_DIR_NAME, subscriptionId)
 	print("create destination folder {} if it does not exist".format(destinationFolder))
 	try:
@@ -87,23 +180,406 @@ def startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey, s
 		os.mkdir(destinationFolder)
 	except:
 		pass
+	return destinationFolder
+
+
+#==============================================
+def createStore(destinationFolder, subscriptionId, logOptions=None, sinkOptions=None, metrics=None):
+#==============================================
+	# returns the store for storePayload (None writes a file per message right away),
+	# the objects to close on shutdown, and whether deletes must wait for the writes
+	store = None
+	closeables = []
+	durable = False
+	if logOptions is not None:
+		store = metadataLog.MetadataLog(destinationFolder, **logOptions)
+		closeables.append(store)
+	if sinkOptions is not None:
+		sinkOptions = dict(sinkOptions)
+		durable = sinkOptions.pop('ackPolicy', writeBehind.ACK_PROCESSED) == writeBehind.ACK_DURABLE
+		if store is None:
+			store = metadataLog.MetadataFiles(destinationFolder, subscriptionId)
+		store = writeBehind.WriteBehindSink(store, metrics = metrics, **sinkOptions)
+		# the sink is flushed before the log it writes to is closed
+		closeables.insert(0, store)
+	return store, closeables, durable
+
+
+#==============================================
+def createDedupe(destinationFolder, dedupeOptions=None):
+#==============================================
+	if dedupeOptions is None:
+		return None
+	dedupeOptions = dict(dedupeOptions)
+	path = dedupeOptions.pop('path', os.path.join(destinationFolder, dedupeCache.DEDUPE_FILE_NAME))
+	return dedupeCache.DedupeCache(path, **dedupeOptions)
+
+
+#==============================================
+def isDuplicate(dedupe, stats, messageId=None, documentId=None, metrics=None):
+#==============================================
+	if dedupe is None or not dedupe.seen(messageId, documentId):
+		return False
+	print("Skipping duplicate message {}".format(documentId or messageId))
+	if stats is not None:
+		_count(stats, 'duplicates')
+	if metrics is not None:
+		metrics.count('duplicates')
+	return True
+
+
+#==============================================
+def createClient(accessID, secretKey, sessionToken):
+#==============================================
+	import boto3
+	# create a SQS session
+	session = boto3.Session(
+		aws_access_key_id = accessID,
+		aws_secret_access_key = secretKey,
+		aws_session_token = sessionToken,
+		region_name = REGION
+	)
+	return session.client('sqs')
+
+
+#==============================================
+def _count(stats, key, value=1):
+#==============================================
+	with statsLock:
+		stats[key] += value
+
+
+#==============================================
+def deleteMessages(sqs, endpoint, messages, stats):
+#==============================================
+	if len(messages) == 1:
+		sqs.delete_message(QueueUrl = endpoint, ReceiptHandle = messages[0]['ReceiptHandle'])
+		_count(stats, 'apiCalls')
+		return
+
+	# acknowledge the whole batch with a single call
+	entries = [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, message in enumerate(messages)]
+	resp = sqs.delete_message_batch(QueueUrl = endpoint, Entries = entries)
+	_count(stats, 'apiCalls')
+
+	# retry the failed entries of a partial batch on their own
+	from botocore.exceptions import ClientError
+	for failed in resp.get('Failed', []):
+		print("Unable to delete message in batch. Code %s, Message: %s" % (failed.get('Code'), failed.get('Message')))
+		if failed.get('SenderFault'):
+			# invalid receipt handle etc., retrying will not help
+			continue
+		try:
+			sqs.delete_message(QueueUrl = endpoint, ReceiptHandle = entries[int(failed['Id'])]['ReceiptHandle'])
+		except ClientError as err:
+			print("Unable to delete message: %s" % err)
+		_count(stats, 'apiCalls')
+
+
+#==============================================
+def acknowledgeMessages(sqs, endpoint, messages, stats, beforeDelete=None, heartbeat=None):
+#==============================================
+	if beforeDelete is not None:
+		beforeDelete()
+	# failed messages are not deleted, so they are processed again (up to MAX_RECEIVE_COUNT receives)
+	retry = [m for m in messages if not m.get('_processed', True)
+		and int(m.get('Attributes', {}).get('ApproximateReceiveCount', 1)) < MAX_RECEIVE_COUNT]
+	done = [m for m in messages if m not in retry]
+	if heartbeat is None:
+		if done:
+			deleteMessages(sqs, endpoint, done, stats)
+		if retry:
+			print("Leaving %d failed messages in the queue" % len(retry))
+		return
+
+	# give failed messages back to the queue for a quick retry instead of waiting for the visibility timeout
+	heartbeat.done(done)
+	if done:
+		deleteMessages(sqs, endpoint, done, stats)
+	if retry:
+		print("Returning %d failed messages to the queue" % len(retry))
+		heartbeat.release(retry)
+
+
+#==============================================
+def printThroughput(stats):
+#==============================================
+	if stats['apiCalls'] > 0:
+		print("Throughput: %d messages in %d API calls (%.2f messages per call)" % (
+			stats['messages'], stats['apiCalls'], float(stats['messages']) / stats['apiCalls']))
+	if stats.get('duplicates'):
+		print("Duplicates: %d of %d messages (%.1f%% hit rate)" % (
+			stats['duplicates'], stats['messages'], 100.0 * stats['duplicates'] / max(1, stats['messages'])))
+
+
+#==============================================
+def _processWorker(workQueue, deleteQueue, handleMessage, jobs):
+#==============================================
+	while 1:
+		message = workQueue.get()
+		if message is None:
+			break
+		try:
+			handleMessage(message)
+		except Exception as err:
+			traceback.print_exc()
+			print(err)
+		# a message is acknowledged only once its processing has finished, with a job of the
+		# callback once the job has, meanwhile the worker takes the next message
+		job = message.get('_job')
+		if job is not None:
+			jobs.add(job)
+			job.add_done_callback(lambda job, message=message: (deleteQueue.put(message), jobs.discard(job)))
+		else:
+			deleteQueue.put(message)
+
+
+#==============================================
+def _deleteWorker(deleteQueue, acknowledge, batchSize, stats, errors):
+#==============================================
+	done = False
+	while not done:
+		messages = [deleteQueue.get()]
+		# wait a moment for more processed messages, up to a full batch
+		deadline = time.time() + DELETE_LINGER_SECONDS
+		while len(messages) < batchSize and None not in messages:
+			try:
+				messages.append(deleteQueue.get(timeout = max(0, deadline - time.time())))
+			except queue.Empty:
+				break
+		if None in messages:
+			done = True
+			# hand the stop markers meant for the other acknowledgers back
+			for i in range(messages.count(None) - 1):
+				deleteQueue.put(None)
+			messages = [m for m in messages if m is not None]
+		if not messages:
+			continue
+		try:
+			for i in range(0, len(messages), batchSize):
+				acknowledge(messages[i:i + batchSize])
+			printThroughput(stats)
+		except Exception as err:
+			traceback.print_exc()
+			errors.append(err)
+
+
+#==============================================
+def _stopPipeline(workQueue, processThreads, deleteQueue, deleteThreads, jobs):
+#==============================================
+	# let the workers finish what was already received, then drain the acknowledgers
+	for t in processThreads:
+		workQueue.put(None)
+	for t in processThreads:
+		t.join()
+	concurrent.futures.wait(list(jobs))
+	for t in deleteThreads:
+		deleteQueue.put(None)
+	for t in deleteThreads:
+		t.join()
+
+
+#==============================================
+def _runPipeline(receiveMessages, handleMessage, acknowledge, batchSize, workers, deleters, queueSize, stats):
+#==============================================
+	workQueue = queue.Queue(maxsize = queueSize)
+	deleteQueue = queue.Queue(maxsize = queueSize)
+	errors = []
+	# jobs of the callback which are still running
+	jobs = set()
+
+	processThreads = [threading.Thread(target = _processWorker, daemon = True,
+		args = (workQueue, deleteQueue, handleMessage, jobs))
+		for i in range(workers)]
+	deleteThreads = [threading.Thread(target = _deleteWorker, daemon = True,
+		args = (deleteQueue, acknowledge, batchSize, stats, errors))
+		for i in range(deleters)]
+	for t in processThreads + deleteThreads:
+		t.start()
+
+	print('Polling messages from queue with %d process workers and %d delete workers...' % (workers, deleters))
+	try:
+		# the calling thread is the receiver stage
+		while not errors:
+			for message in receiveMessages():
+				# does not block, the receiver keeps at most queueSize messages in the pipeline
+				workQueue.put(message)
+	except KeyboardInterrupt:
+		# unacknowledged messages become visible on the queue again
+		raise
+	except Exception:
+		_stopPipeline(workQueue, processThreads, deleteQueue, deleteThreads, jobs)
+		raise
+
+	_stopPipeline(workQueue, processThreads, deleteQueue, deleteThreads, jobs)
+	raise errors[0]
+
+
+#==============================================
+def startPolling(accessID, secretKey, sessionToken, endpoint, cryptographyKey, subscriptionId, isRawResponse, callback=None, fileType=None, batchSize=1, workers=0, deleters=1, queueSize=PIPELINE_QUEUE_SIZE, lowWater=None, logOptions=None, sinkOptions=None, visibilityTimeout=None, dedupeOptions=None, credentials=None, metricsOptions=None, client=None):
+#==============================================
+	destinationFolder = createDestinationFolder(subscriptionId)
+	if client is not None:
+		# e.g. the local stand-in of sqsBenchmark.py
+		sqs = client
+	elif credentials is not None:
+		# a credentialManager.CredentialManager, the client is swapped when the credentials rotate
+		sqs = credentialManager.RotatingClient(credentials, createClient)
+	else:
+		sqs = createClient(accessID, secretKey, sessionToken)
+	batchSize = max(1, min(batchSize, MAX_BATCH_SIZE))
+	stats = {'messages': 0, 'apiCalls': 0, 'duplicates': 0}
+	decryptor = Decryptor(cryptographyKey)
+	# always recorded, served or written out when metricsOptions asks for it
+	metrics = pipelineMetrics.forSubscription(subscriptionId)
+	pipelineMetrics.startExporters(metricsOptions)
+	# with logOptions the messages go into rotating JSONL segments, with sinkOptions they are written behind
+	store, closeables, durable = createStore(destinationFolder, subscriptionId, logOptions, sinkOptions, metrics)
+	# only wait for the writes before acknowledging when the policy asks for it
+	beforeDelete = store.flush if durable else None
+	# redelivered messages are acknowledged without processing them again
+	dedupe = createDedupe(destinationFolder, dedupeOptions)
+	if dedupe is not None:
+		closeables.append(dedupe)
+	if client is None and credentials is not None:
+		closeables.append(sqs)
+	backlogInterval = (metricsOptions or {}).get('backlogInterval', pipelineMetrics.DEFAULT_BACKLOG_INTERVAL)
+	if metricsOptions and backlogInterval:
+		closeables.append(pipelineMetrics.BacklogSampler(sqs, endpoint, metrics, backlogInterval))
+
+	# with a visibility timeout, in-flight messages are kept invisible by heartbeats
+	heartbeat = None
+	receiveOptions = {'AttributeNames': RECEIVE_ATTRIBUTES}
+	if visibilityTimeout:
+		heartbeat = visibilityHeartbeat.VisibilityHeartbeat(sqs, endpoint, visibilityTimeout)
+		heartbeat.start()
+		receiveOptions['VisibilityTimeout'] = visibilityTimeout
+
+	# the workers buffer messages, queueSize is the high-water mark of what was received but not acknowledged
+	flow = backpressure.FlowControl(queueSize, lowWater, metrics) if workers > 0 else None
+
+	def receiveMessages(waitTime=WAIT_TIME_SECONDS):
+		maxMessages = batchSize
+		if flow is not None:
+			# waits while the pipeline is full, the backlog stays in the queue
+			maxMessages = flow.admit(batchSize)
+		start = time.perf_counter()
+		resp = sqs.receive_message(QueueUrl = endpoint, WaitTimeSeconds = waitTime, MaxNumberOfMessages = maxMessages, **receiveOptions)
+		metrics.observe('receive', time.perf_counter() - start)
+		_count(stats, 'apiCalls')
+		messages = resp.get('Messages', [])
+		if flow is not None:
+			flow.add(len(messages))
+		_count(stats, 'messages', len(messages))
+		metrics.count('messages', len(messages))
+		metrics.count('bytes', sum(len(message['Body']) for message in messages))
+		if heartbeat is not None:
+			heartbeat.track(messages)
+		return messages
+
+	def skipDuplicate(message):
+		if isDuplicate(dedupe, stats, messageId = message.get('MessageId'), metrics = metrics):
+			message['_processed'] = True
+			return True
+		return False
+
+	def handleMessage(message, m=None):
+		# stays False when the decryption fails
+		message['_processed'] = False
+		if m is None:
+			if skipDuplicate(message):
+				return
+			start = time.perf_counter()
+			m = decryptor.decrypt(message['Body'])
+			metrics.observe('decrypt', time.perf_counter() - start)
+		result = processPayload(m, subscriptionId, fileType, destinationFolder, isRawResponse, callback, store,
+			message.get('MessageId'), dedupe, stats, metrics)
+		if isinstance(result, concurrent.futures.Future):
+			message['_job'] = result
+			result.add_done_callback(lambda job: jobDone(message, job))
+			return
+		message['_processed'] = result
+		if result:
+			metrics.observeLag(message)
+
+	def jobDone(message, job):
+		# runs before the message is queued for acknowledging
+		message['_processed'] = jobSucceeded(job)
+		if message['_processed']:
+			metrics.observeLag(message)
+
+	def acknowledge(messages):
+		metrics.count('errors', sum(1 for message in messages if not message.get('_processed', True)))
+		start = time.perf_counter()
+		try:
+			acknowledgeMessages(sqs, endpoint, messages, stats, beforeDelete, heartbeat)
+		finally:
+			if flow is not None:
+				flow.release(len(messages))
+		metrics.observe('delete', (time.perf_counter() - start) / len(messages), len(messages))
+
+	try:
+		if workers > 0:
+			# staged mode: receive -> decrypt/process pool -> delete acknowledger. The acknowledgers do not wait
+			# for a fuller batch than the receiver needs to be released to resume
+			deleteBatchSize = min(batchSize, flow.highWater - flow.lowWater)
+			_runPipeline(receiveMessages, handleMessage, acknowledge, deleteBatchSize, workers, max(1, deleters), queueSize, stats)
+			return
+
+		print('Polling messages from queue...')
+		# messages whose job of the callback has finished, and the number of jobs still running
+		completed = queue.Queue()
+		running = 0
+		try:
+			while 1: 
+				messages = receiveMessages(JOB_WAIT_TIME_SECONDS if running else WAIT_TIME_SECONDS)
+				ready = []
+			
+				if messages:
+					# decrypt and print all the nested messages, known duplicates are not decrypted
+					fresh = [message for message in messages if not skipDuplicate(message)]
+					start = time.perf_counter()
+					payloads = decryptor.decrypt_many([message['Body'] for message in fresh])
+					if fresh:
+						metrics.observe('decrypt', (time.perf_counter() - start) / len(fresh), len(fresh))
+					for message, m in zip(fresh, payloads):
+						handleMessage(message, m)
+						if '_job' in message:
+							running += 1
+							message['_job'].add_done_callback(lambda job, message=message: completed.put(message))
+					ready = [message for message in messages if '_job' not in message]
 
-	sqs = session.client('sqs')
-
-	print('Polling messages from queue...')
-	while 1: 
-		resp = sqs.receive_message(QueueUrl = endpoint, WaitTimeSeconds = 10)
-		
-		if 'Messages' in resp:
-			messages = resp['Messages']
-			# print and remove all the nested messages
-			for message in messages:
-				mBody = message['Body']
-				# decrypt this message
-				m = decrypt(cryptographyKey, mBody)
-				processPayload(m, subscriptionId, fileType, destinationFolder, isRawResponse, callback)
-				# *** accumulate and remove all the nested message
-				sqs.delete_message(QueueUrl = endpoint, ReceiptHandle = message['ReceiptHandle'])
+				# messages with a job are acknowledged after it finished, while receiving goes on
+				while not completed.empty():
+					ready.append(completed.get())
+					running -= 1
+				if ready:
+					# *** accumulate and remove all the nested messages at once
+					for i in range(0, len(ready), MAX_BATCH_SIZE):
+						acknowledge(ready[i:i + MAX_BATCH_SIZE])
+					printThroughput(stats)
+		except Exception:
+			# e.g. expired credentials, the messages of the running jobs are still acknowledged
+			if running:
+				print("Waiting for %d jobs before stopping" % running)
+				ready = [completed.get() for i in range(running)]
+				try:
+					for i in range(0, len(ready), MAX_BATCH_SIZE):
+						acknowledge(ready[i:i + MAX_BATCH_SIZE])
+				except Exception as err:
+					print("Unable to acknowledge messages: %s" % err)
+			raise
+	finally:
+		if heartbeat is not None:
+			heartbeat.close()
+			try:
+				# do not leave what was received but not processed invisible until the timeout
+				heartbeat.releaseAll()
+			except Exception as err:
+				print("Unable to release messages: %s" % err)
+		# write out the pending messages on shutdown
+		for closeable in closeables:
+			closeable.close()
 
 
 
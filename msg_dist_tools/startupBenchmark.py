@@ -0,0 +1,86 @@
+#=============================================================================
+# Cold start benchmark of the command line tools
+# Imports each entry point in a fresh interpreter with python -X importtime and reports
+# the median import time, the heaviest imports, and whether it stays within its budget
+#	python startupBenchmark.py [number of runs]
+# The exit code is 1 when an entry point is over its budget
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import os
+import statistics
+import subprocess
+import sys
+
+# import time budget of each entry point in milliseconds, the list and delete commands run from cron
+BUDGETS = {
+	"researchMessages": 250,
+	"newsMessages": 250,
+	"rdpToken": 200,
+	"filings": 200,
+	"symbology": 200,
+	"timeSeries": 200,
+	"search": 200,
+	"metadataLog": 100
+}
+# modules which must not be loaded by any entry point, they are imported when polling starts (asyncio by asyncMessages only)
+LAZY_MODULES = ["boto3", "botocore", "Crypto", "asyncio"]
+TOP_IMPORTS = 5
+
+
+#==============================================
+def importTimes(module):
+#==============================================
+	# returns {imported module: cumulative microseconds} of one cold import, without the
+	# modules the interpreter itself loads at startup, e.g. site
+	folder = os.path.dirname(os.path.abspath(__file__))
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+		cwd = folder, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True, check = True)
+	times = {}
+	for line in result.stderr.splitlines():
+		# import time: self [us] | cumulative | imported package, nested imports are indented
+		# and listed before the module which imported them
+		parts = line.split("|")
+		if len(parts) != 3 or not line.startswith("import time:") or "cumulative" in parts[1]:
+			continue
+		name = parts[2][1:]
+		times[name.strip()] = int(parts[1])
+		if not name.startswith(" "):
+			if name == module:
+				return times
+			# a top level import of the startup, not part of the module
+			times = {}
+	return times
+
+
+#==============================================
+def runBenchmark(module, runs):
+#==============================================
+	samples = [importTimes(module) for i in range(runs)]
+	total = statistics.median(sample[module] for sample in samples) / 1000.0
+	budget = BUDGETS[module]
+	status = "ok" if total <= budget else "OVER BUDGET"
+	print("%-18s %7.1f ms  (budget %d ms)  %s" % (module, total, budget, status))
+
+	last = samples[-1]
+	lazy = [name for name in last if name.split(".")[0] in LAZY_MODULES]
+	if lazy:
+		status = "OVER BUDGET"
+		print("    loads %s at startup" % ", ".join(sorted(set(name.split(".")[0] for name in lazy))))
+	# only top level packages, their submodules are part of the cumulative time
+	heaviest = sorted(((t, name) for name, t in last.items() if "." not in name and name != module), reverse = True)
+	for t, name in heaviest[:TOP_IMPORTS]:
+		print("    %-20s %7.1f ms" % (name, t / 1000.0))
+	return status == "ok"
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+	print("Median cold import time of %d runs" % runs)
+	results = [runBenchmark(module, runs) for module in BUDGETS]
+	sys.exit(0 if all(results) else 1)
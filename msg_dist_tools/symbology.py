@@ -5,7 +5,7 @@
 #   and is provided AS IS with no warranty or guarantee of fit for purpose.
 #   Copyright (C) 2021 Refinitiv. All rights reserved.
 # =============================================================================
-import requests
+import rdpClient
 import json
 import rdpToken
 
@@ -21,7 +21,7 @@ endpoint_URL = "/lookup"
 def convertSymbology(requestData):
 #==============================================
 	RESOURCE_ENDPOINT = base_URL + category_URL + RDP_version + endpoint_URL
-	dResp = requests.post(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, data=json.dumps(requestData))
+	dResp = rdpClient.post(RESOURCE_ENDPOINT, headers = {"Authorization": "Bearer " + accessToken}, data=json.dumps(requestData))
 	if dResp.status_code != 200:
 		print("Unable to get data. Code %s, Message: %s" % (dResp.status_code, dResp.text))
 	else:
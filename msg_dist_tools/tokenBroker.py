@@ -0,0 +1,96 @@
+#=============================================================================
+# Local token broker shared by the tools running on one machine
+# The broker owns the rdpToken logic and hands the current access token to the other
+# processes over a Unix domain socket, so the host refreshes the token once per expiry
+# instead of once per process. rdpToken.getToken asks the broker when its socket exists, and
+# rdpToken.invalidateToken has the broker replace a token which was rejected
+#	python tokenBroker.py [-s <socket file>]
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import getopt
+import json
+import os
+import signal
+import socketserver
+import sys
+import traceback
+import rdpToken
+
+REQUEST = b"GET\n"
+# followed by the rejected access token
+RENEW = b"RENEW "
+
+
+#==============================================
+class TokenRequestHandler(socketserver.StreamRequestHandler):
+#==============================================
+	def handle(self):
+		request = self.rfile.readline()
+		if request != REQUEST and not request.startswith(RENEW):
+			return
+		try:
+			if request.startswith(RENEW):
+				# only the token still cached is replaced, the processes renewing it after the first get the new one
+				rdpToken.invalidateToken(request[len(RENEW):].strip().decode())
+			accessToken = rdpToken.getToken()
+			tknObject = rdpToken._cachedToken
+			response = {
+				"access_token": accessToken,
+				"expiry_tm": tknObject["expiry_tm"],
+				"uuid": rdpToken.UUID
+			}
+		except Exception as err:
+			traceback.print_exc()
+			response = {"error": str(err)}
+		self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+#==============================================
+def startBroker(socketFile=rdpToken.BROKER_SOCKET):
+#==============================================
+	# the broker itself must use the token file, not ask itself
+	rdpToken.BROKER_SOCKET = None
+	if os.path.exists(socketFile):
+		# left over from a broker which was killed
+		os.remove(socketFile)
+
+	# fail early on bad credentials, and start the background refresher
+	rdpToken.getToken()
+	# the tokens are for the local user only, the socket is created private rather than opened up until the chmod
+	umask = os.umask(0o077)
+	try:
+		server = socketserver.ThreadingUnixStreamServer(socketFile, TokenRequestHandler)
+	finally:
+		os.umask(umask)
+	server.daemon_threads = True
+	os.chmod(socketFile, 0o600)
+	print("Token broker listening on %s, press BREAK to exit..." % socketFile)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		os.remove(socketFile)
+
+
+
+#==============================================
+if __name__ == "__main__":
+#==============================================
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "s:", ["socket="])
+	except getopt.GetoptError:
+		print('Usage: python tokenBroker.py [-s <socket file>]')
+		sys.exit(2)
+	socketFile = rdpToken.BROKER_SOCKET
+	for opt, arg in opts:
+		if opt in ("-s", "--socket"):
+			socketFile = arg
+	# remove the socket on a kill too, the clients would try a stale one first
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		startBroker(socketFile)
+	except KeyboardInterrupt:
+		print("User requested break, stopping the broker...")
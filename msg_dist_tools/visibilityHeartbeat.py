@@ -0,0 +1,116 @@
+#=============================================================================
+# Visibility timeout heartbeats for messages which are still being processed
+# While a message is in flight its visibility timeout is extended in batches, so SQS does
+# not hand it out a second time during a long report download. Messages the poller gives
+# up on are made visible again right away, so they are retried without waiting
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import threading
+import time
+import traceback
+
+DEFAULT_VISIBILITY_TIMEOUT = 60
+# change_message_visibility_batch accepts up to 10 entries
+MAX_BATCH_SIZE = 10
+
+
+#==============================================
+def visibilityEntries(handles, visibilityTimeout):
+#==============================================
+	# split into change_message_visibility_batch requests
+	for i in range(0, len(handles), MAX_BATCH_SIZE):
+		yield [{'Id': str(j), 'ReceiptHandle': handle, 'VisibilityTimeout': visibilityTimeout}
+			for j, handle in enumerate(handles[i:i + MAX_BATCH_SIZE])]
+
+
+#==============================================
+def printFailed(resp):
+#==============================================
+	for failed in resp.get('Failed', []):
+		# usually the message was deleted meanwhile
+		print("Unable to change message visibility. Code %s, Message: %s" % (failed.get('Code'), failed.get('Message')))
+
+
+#==============================================
+def changeVisibility(sqs, endpoint, handles, visibilityTimeout):
+#==============================================
+	for entries in visibilityEntries(handles, visibilityTimeout):
+		printFailed(sqs.change_message_visibility_batch(QueueUrl = endpoint, Entries = entries))
+
+
+#==============================================
+class VisibilityHeartbeat:
+#==============================================
+	# sqs may be None when the caller drives the heartbeat itself, e.g. from asyncio
+	def __init__(self, sqs, endpoint, visibilityTimeout=DEFAULT_VISIBILITY_TIMEOUT):
+		self.sqs = sqs
+		self.endpoint = endpoint
+		self.visibilityTimeout = visibilityTimeout
+		# extend well before the current timeout runs out
+		self.interval = max(1.0, visibilityTimeout / 3.0)
+		self.lock = threading.Lock()
+		self.inFlight = {}
+		self.stopEvent = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	def track(self, messages):
+		now = time.time()
+		with self.lock:
+			for message in messages:
+				self.inFlight[message['ReceiptHandle']] = now
+
+	def done(self, messages):
+		with self.lock:
+			for message in messages:
+				self.inFlight.pop(message['ReceiptHandle'], None)
+
+	def dueHandles(self):
+		# handles whose visibility was last set more than an interval ago
+		now = time.time()
+		with self.lock:
+			handles = [handle for handle, extended in self.inFlight.items() if now - extended >= self.interval]
+			for handle in handles:
+				self.inFlight[handle] = now
+		return handles
+
+	def pendingHandles(self):
+		with self.lock:
+			handles = list(self.inFlight)
+			self.inFlight.clear()
+		return handles
+
+	def extend(self):
+		handles = self.dueHandles()
+		if handles:
+			changeVisibility(self.sqs, self.endpoint, handles, self.visibilityTimeout)
+
+	def release(self, messages):
+		# make the messages visible again right away
+		self.done(messages)
+		changeVisibility(self.sqs, self.endpoint, [message['ReceiptHandle'] for message in messages], 0)
+
+	def releaseAll(self):
+		handles = self.pendingHandles()
+		if handles:
+			print("Releasing %d unprocessed messages back to the queue" % len(handles))
+			changeVisibility(self.sqs, self.endpoint, handles, 0)
+
+	def close(self):
+		self.stopEvent.set()
+		if self.thread is not None:
+			self.thread.join()
+
+	def _run(self):
+		while not self.stopEvent.wait(self.interval / 2.0):
+			try:
+				self.extend()
+			except Exception as err:
+				traceback.print_exc()
+				print(err)
@@ -0,0 +1,131 @@
+#=============================================================================
+# Write-behind sink for the received messages
+# Messages are queued in memory and written by a background thread in batches, once
+# enough messages are waiting or the oldest one has waited long enough. The polling
+# thread does not wait for the disk unless the acknowledgement policy asks for it, or the disk
+# falls so far behind that maxPending messages are waiting. A batch which could not be written
+# stays pending and is retried, so it is not acknowledged as written
+#-----------------------------------------------------------------------------
+#   This source code is provided under the Apache 2.0 license
+#   and is provided AS IS with no warranty or guarantee of fit for purpose.
+#   Copyright (C) 2021 Refinitiv. All rights reserved.
+#=============================================================================
+import threading
+import time
+import traceback
+
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_DELAY = 1.0
+# appending blocks while this many messages are waiting to be written
+DEFAULT_MAX_PENDING = 1000
+# seconds before a batch which could not be written is tried again
+RETRY_DELAY = 5
+# acknowledgement policies: delete the SQS message once it is processed, or only once it is written
+ACK_PROCESSED = "processed"
+ACK_DURABLE = "durable"
+
+
+#==============================================
+class WriteBehindSink:
+#==============================================
+	# target must provide appendMany(records), e.g. metadataLog.MetadataLog or metadataLog.MetadataFiles
+	# metrics is a pipelineMetrics.PipelineMetrics, the time append waits for room is recorded for the sink stage
+	def __init__(self, target, maxBatch=DEFAULT_MAX_BATCH, maxDelay=DEFAULT_MAX_DELAY, maxPending=DEFAULT_MAX_PENDING, metrics=None):
+		self.target = target
+		self.maxBatch = maxBatch
+		self.maxDelay = maxDelay
+		self.maxPending = max(maxBatch, maxPending)
+		self.metrics = metrics
+		self.condition = threading.Condition()
+		self.pending = []
+		self.sequence = 0
+		self.written = 0
+		self.flushRequested = 0
+		self.closed = False
+		# no write before then, after a failed one
+		self.retryAt = 0
+		# the error of the last try on close, when the pending messages had to be dropped
+		self.error = None
+		self.thread = threading.Thread(target = self._run, daemon = True)
+		self.thread.start()
+
+	def append(self, rMessage, messageId=None):
+		# returns a sequence number which can be passed to waitWritten
+		with self.condition:
+			if len(self.pending) >= self.maxPending:
+				# backpressure, the caller does not take more messages until the disk catches up
+				start = time.perf_counter()
+				while len(self.pending) >= self.maxPending and not self.closed:
+					self.condition.wait()
+				if self.metrics is not None:
+					self.metrics.addBlocked('sink', time.perf_counter() - start)
+			if self.closed:
+				raise Exception("Write-behind sink is closed")
+			self.sequence += 1
+			self.pending.append({"MessageId": messageId, "time": time.time(), "message": rMessage})
+			if len(self.pending) == 1 or len(self.pending) >= self.maxBatch:
+				self.condition.notify_all()
+			return self.sequence
+
+	def waitWritten(self, sequence):
+		# writes the pending batch right away instead of waiting for it to fill up
+		with self.condition:
+			self.flushRequested = max(self.flushRequested, sequence)
+			self.condition.notify_all()
+			while self.written < sequence:
+				self.condition.wait()
+			if self.error is not None:
+				raise Exception("Write-behind sink failed to write messages: %s" % self.error)
+
+	def flush(self):
+		self.waitWritten(self.sequence)
+
+	def close(self):
+		# writes whatever is still pending before returning
+		with self.condition:
+			if self.closed:
+				return
+			self.closed = True
+			# one last try of a failed batch right away
+			self.retryAt = 0
+			self.condition.notify_all()
+		self.thread.join()
+
+	def _due(self):
+		if not self.pending or time.time() < self.retryAt:
+			return False
+		return (self.closed or len(self.pending) >= self.maxBatch or self.flushRequested > self.written
+			or time.time() >= self.pending[0]["time"] + self.maxDelay)
+
+	def _run(self):
+		while 1:
+			with self.condition:
+				while not self._due():
+					if self.closed:
+						return
+					timeout = None
+					if self.pending:
+						# counted from the oldest waiting message
+						timeout = max(0, max(self.pending[0]["time"] + self.maxDelay, self.retryAt) - time.time())
+					self.condition.wait(timeout)
+				records = self.pending[:self.maxBatch]
+				del self.pending[:self.maxBatch]
+				last = self.written + len(records)
+
+			try:
+				self.target.appendMany(records)
+			except Exception as err:
+				traceback.print_exc()
+				with self.condition:
+					if not self.closed:
+						# kept pending, waitWritten does not return before they are written
+						print("Unable to write %d messages, retrying in %d seconds: %s" % (len(records), RETRY_DELAY, err))
+						self.pending[:0] = records
+						self.retryAt = time.time() + RETRY_DELAY
+						continue
+					print("Unable to write %d messages on close, dropping them: %s" % (len(records), err))
+					self.error = err
+
+			with self.condition:
+				self.written = last
+				self.condition.notify_all()